@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+import argparse
+import gzip
+import json
+import os
+import platform
+import random
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Callable, Iterable
+
+from config import Config
+from log_analyzer import process_request_logs, save_result
+from log_parser import parse_log_line, parse_log_line_fast, read_log_lines
+from metrics import Metrics
+
+LOG_LINE = (
+    '1.196.116.32 -  - [29/Jun/2017:03:50:22 +0300] '
+    '"{method} {url} HTTP/1.1" 200 927 "-" '
+    '"Lynx/2.8.8dev.9 libwww-FM/2.14 SSL-MM/1.4.1 GNUTLS/2.10.5" "-" '
+    '"1498697422-2190034393-4708-9752759" "dc7161be3" {duration:.3f}\n'
+)
+MALFORMED_LINE = '1.196.116.32 -  - [29/Jun/2017:03:50:22 +0300] "-" 400 -\n'
+
+DURATIONS: dict[str, Callable[[random.Random], float]] = {
+    'exp': lambda rnd: rnd.expovariate(5),
+    'lognormal': lambda rnd: rnd.lognormvariate(-2, 1.5),
+    'uniform': lambda rnd: rnd.uniform(0, 1),
+}
+
+
+def generate_log_lines(
+        count: int,
+        urls: int = 10_000,
+        distribution: str = 'exp',
+        malformed: float = 0,
+        seed: int = 0,
+) -> list[str]:
+    rnd = random.Random(seed)
+    duration = DURATIONS[distribution]
+    return [
+        MALFORMED_LINE if rnd.random() < malformed else LOG_LINE.format(
+            method=rnd.choice(('GET', 'POST')),
+            url=f'/api/v2/banner/{rnd.randrange(urls)}',
+            duration=duration(rnd),
+        )
+        for _ in range(count)
+    ]
+
+
+def measure(func: Callable, lines: Iterable) -> float:
+    start = time.perf_counter()
+    for line in lines:
+        try:
+            func(line)
+        except ValueError:
+            pass
+
+    return time.perf_counter() - start
+
+
+def _stage_result(
+        stage: str,
+        elapsed: float,
+        count: int,
+        unit: str = 'lines',
+) -> dict[str, Any]:
+    per_sec = round(count / elapsed) if elapsed else 0
+    result = {
+        'stage': stage,
+        'seconds': round(elapsed, 4),
+        unit: count,
+        f'{unit}_per_sec': per_sec,
+        'peak_rss_kb': Metrics.peak_rss_kb(),
+    }
+    print(
+        f'{stage:<24}{elapsed:>10.3f} s{per_sec:>14,} {unit}/sec'
+        f'{result["peak_rss_kb"]:>12,} KB peak RSS',
+    )
+    return result
+
+
+def run_benchmark(
+        lines: list[str],
+        tmp_dir: str,
+        compress: bool = False,
+        report_size: int = 1000,
+) -> list[dict[str, Any]]:
+    results = []
+
+    elapsed = measure(parse_log_line, lines)
+    results.append(_stage_result('parse_log_line', elapsed, len(lines)))
+
+    byte_lines = [line.encode('utf-8') for line in lines]
+    elapsed = measure(parse_log_line_fast, byte_lines)
+    results.append(_stage_result('parse_log_line_fast', elapsed, len(lines)))
+    del byte_lines
+
+    log_path = os.path.join(tmp_dir, 'nginx-access-ui.log-20170630')
+    open_func: Callable = open
+    if compress:
+        log_path += '.gz'
+        open_func = gzip.open
+    with open_func(log_path, 'wt', encoding='utf-8') as log_file:
+        log_file.writelines(lines)
+
+    start = time.perf_counter()
+    request_logs = list(read_log_lines(log_path))
+    elapsed = time.perf_counter() - start
+    results.append(_stage_result('read_log_lines', elapsed, len(lines)))
+
+    start = time.perf_counter()
+    request_stats, _ = process_request_logs(
+        request_log for request_log in request_logs
+    )
+    elapsed = time.perf_counter() - start
+    results.append(_stage_result('process_request_logs', elapsed, len(lines)))
+
+    config = Config(REPORT_DIR=tmp_dir, REPORT_SIZE=report_size)
+    start = time.perf_counter()
+    save_result(config, request_stats, 'report-20170630.html')
+    elapsed = time.perf_counter() - start
+    results.append(_stage_result(
+        'save_result', elapsed, min(len(request_stats), report_size), 'rows',
+    ))
+
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lines', dest='lines', type=int, default=200_000)
+    parser.add_argument('--urls', dest='urls', type=int, default=10_000)
+    parser.add_argument(
+        '--distribution',
+        dest='distribution',
+        choices=sorted(DURATIONS),
+        default='exp',
+    )
+    parser.add_argument(
+        '--malformed', dest='malformed', type=float, default=0.,
+    )
+    parser.add_argument('--gzip', dest='gzip', action='store_true')
+    parser.add_argument(
+        '--report-size', dest='report_size', type=int, default=1000,
+    )
+    parser.add_argument('--seed', dest='seed', type=int, default=0)
+    parser.add_argument('--output', dest='output')
+    args = parser.parse_args()
+
+    lines = generate_log_lines(
+        args.lines, args.urls, args.distribution, args.malformed, args.seed,
+    )
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        stages = run_benchmark(lines, tmp_dir, args.gzip, args.report_size)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output_file:
+            json.dump(
+                {
+                    'date': datetime.now().isoformat(timespec='seconds'),
+                    'python': platform.python_version(),
+                    'params': vars(args),
+                    'stages': stages,
+                },
+                output_file,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
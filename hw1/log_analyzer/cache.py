@@ -0,0 +1,204 @@
+import mmap
+import os
+import struct
+from array import array
+from typing import Optional
+
+from columnar import ColumnarLogAggregate, np
+from config import Config
+from faults import FaultMonitor
+from log_parser import File, parse_log_lines, read_log_chunks, split_chunk
+from metrics import Metrics
+from parallel import AggregateFactory
+from stats import LogAggregate
+
+# magic, source size, source mtime, total lines, failed lines, number of
+# URLs, size of URLs block, number of requests
+_HEADER = struct.Struct('<8sQqQQQQQ')
+_MAGIC = b'LOGCACH1'
+# Requests converted to Python objects at a time by LogCache.aggregate
+AGGREGATE_BLOCK = 1 << 20
+
+
+class LogCache:
+    # Parsed log as columns: URL dictionary, int32 URL ids and float32
+    # durations of successfully parsed lines. Columns are memory-mapped
+    # from the cache file, nothing is copied on load.
+    def __init__(self, cache_path: str) -> None:
+        with open(cache_path, 'rb') as cache_file:
+            self._data = mmap.mmap(
+                cache_file.fileno(), 0, access=mmap.ACCESS_READ,
+            )
+
+        (
+            magic,
+            self.source_size,
+            self.source_mtime_ns,
+            self.total_lines,
+            self.failed_count,
+            url_count,
+            urls_size,
+            request_count,
+        ) = _HEADER.unpack_from(self._data)
+        if magic != _MAGIC:
+            raise ValueError(f'{cache_path} is not a log cache')
+
+        urls_end = _HEADER.size + urls_size
+        urls = self._data[_HEADER.size:urls_end].decode('utf-8')
+        self.urls = urls.split('\n') if url_count else []
+        self.request_count = request_count
+        self._ids_start = _aligned(urls_end)
+        self._durations_start = self._ids_start + 4 * request_count
+        view = memoryview(self._data)
+        self.ids = view[self._ids_start:self._durations_start].cast('i')
+        self.durations = view[
+            self._durations_start:self._durations_start + 4 * request_count
+        ].cast('f')
+
+    def is_valid_for(self, log_path: str) -> bool:
+        stat = os.stat(log_path)
+        return (
+            self.source_size == stat.st_size
+            and self.source_mtime_ns == stat.st_mtime_ns
+        )
+
+    def close(self) -> None:
+        self.ids.release()
+        self.durations.release()
+        self._data.close()
+
+    def aggregate(self, aggregate: LogAggregate) -> None:
+        aggregate.total_lines += self.total_lines
+        aggregate.failed_count += self.failed_count
+        if isinstance(aggregate, ColumnarLogAggregate):
+            aggregate.add_columns(
+                self.urls,
+                np.frombuffer(
+                    self._data,
+                    dtype=np.int32,
+                    count=self.request_count,
+                    offset=self._ids_start,
+                ),
+                np.frombuffer(
+                    self._data,
+                    dtype=np.float32,
+                    count=self.request_count,
+                    offset=self._durations_start,
+                ),
+            )
+            return
+
+        urls = self.urls
+        for start in range(0, self.request_count, AGGREGATE_BLOCK):
+            end = start + AGGREGATE_BLOCK
+            for url_id, duration in zip(
+                    self.ids[start:end].tolist(),
+                    self.durations[start:end].tolist(),
+            ):
+                aggregate.add_request(urls[url_id], duration)
+
+
+def _aligned(offset: int) -> int:
+    return (offset + 3) & ~3
+
+
+def get_cache_path(cache_dir: str, log_file: File) -> str:
+    return os.path.join(cache_dir, f'{log_file.name}.cache')
+
+
+def build_cache(
+        log_path: str,
+        cache_path: str,
+        monitor: Optional[FaultMonitor] = None,
+) -> None:
+    # Source stat is taken before reading, so a log changed while it is
+    # being read makes the cache invalid
+    stat = os.stat(log_path)
+    url_ids: dict[str, int] = {}
+    ids = array('i')
+    durations = array('f')
+    total_lines = failed_count = 0
+    for chunk, _ in read_log_chunks(log_path):
+        lines = split_chunk(chunk)
+        request_logs = list(parse_log_lines(lines))
+        for request_log in request_logs:
+            if not request_log.success:
+                failed_count += 1
+                continue
+
+            url = request_log.request.name
+            url_id = url_ids.get(url)
+            if url_id is None:
+                url_id = url_ids[url] = len(url_ids)
+            ids.append(url_id)
+            durations.append(request_log.duration)
+
+        total_lines += len(request_logs)
+        if monitor is not None:
+            monitor.add(lines, request_logs)
+            monitor.check()
+
+    urls = '\n'.join(url_ids).encode('utf-8')
+    header = _HEADER.pack(
+        _MAGIC,
+        stat.st_size,
+        stat.st_mtime_ns,
+        total_lines,
+        failed_count,
+        len(url_ids),
+        len(urls),
+        len(ids),
+    )
+    os.makedirs(os.path.dirname(cache_path) or '.', exist_ok=True)
+    tmp_path = f'{cache_path}.tmp'
+    with open(tmp_path, 'wb') as cache_file:
+        cache_file.write(header)
+        cache_file.write(urls)
+        padding = _aligned(len(header) + len(urls)) - len(header) - len(urls)
+        cache_file.write(b'\0' * padding)
+        ids.tofile(cache_file)
+        durations.tofile(cache_file)
+    os.replace(tmp_path, cache_path)
+
+
+def load_cache(log_path: str, cache_path: str) -> Optional[LogCache]:
+    # Returns None if there is no cache or the log was changed since
+    if not os.path.exists(cache_path):
+        return None
+
+    cache = LogCache(cache_path)
+    if not cache.is_valid_for(log_path):
+        cache.close()
+        return None
+
+    return cache
+
+
+def aggregate_cached(
+        config: Config,
+        log_file: File,
+        make_aggregate: AggregateFactory,
+        metrics: Optional[Metrics] = None,
+        monitor: Optional[FaultMonitor] = None,
+) -> LogAggregate:
+    # Log is parsed into the cache once, every run aggregates the cache
+    metrics = metrics or Metrics()
+    log_path = os.path.join(config.LOG_DIR, log_file.name)
+    cache_path = get_cache_path(config.CACHE_DIR, log_file)  # type: ignore
+    with metrics.stage('read'):
+        cache = load_cache(log_path, cache_path)
+    if cache is None:
+        with metrics.stage('cache'):
+            build_cache(log_path, cache_path, monitor)
+        cache = LogCache(cache_path)
+
+    aggregate = make_aggregate()
+    try:
+        with metrics.stage('aggregate'):
+            cache.aggregate(aggregate)
+        metrics.count('lines', cache.total_lines)
+    finally:
+        cache.close()
+
+    metrics.count('bytes', os.path.getsize(cache_path))
+    return aggregate
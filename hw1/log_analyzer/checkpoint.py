@@ -0,0 +1,129 @@
+import logging
+import os
+import pickle
+from dataclasses import dataclass
+from typing import Optional
+
+from config import Config
+from faults import FaultMonitor
+from log_parser import File, read_log_chunks
+from metrics import Metrics
+from parallel import AggregateFactory, add_log_chunk
+from stats import LogAggregate
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Checkpoint:
+    log_name: str
+    inode: int
+    # Offset right after the last processed line (in the decompressed
+    # stream for .gz logs)
+    offset: int
+    aggregate: LogAggregate
+
+
+def _checkpoint_path(config: Config, log_file: File) -> str:
+    return os.path.join(
+        config.CHECKPOINT_DIR,
+        f'checkpoint-{log_file.date.strftime("%Y%m%d")}.pickle',
+    )
+
+
+def load_checkpoint(config: Config, log_file: File) -> Optional[Checkpoint]:
+    checkpoint_path = _checkpoint_path(config, log_file)
+    if not os.path.isfile(checkpoint_path):
+        return None
+
+    with open(checkpoint_path, 'rb') as checkpoint_file:
+        checkpoint: Checkpoint = pickle.load(checkpoint_file)
+
+    log_stat = os.stat(os.path.join(config.LOG_DIR, log_file.name))
+    if (
+            checkpoint.log_name != log_file.name
+            or checkpoint.inode != log_stat.st_ino
+            or (
+                not log_file.name.endswith('.gz')
+                and checkpoint.offset > log_stat.st_size
+            )
+    ):
+        logger.info('Checkpoint %s is stale, ignoring it', checkpoint_path)
+        return None
+
+    return checkpoint
+
+
+def save_checkpoint(
+        config: Config,
+        log_file: File,
+        checkpoint: Checkpoint,
+) -> None:
+    os.makedirs(config.CHECKPOINT_DIR, exist_ok=True)
+    checkpoint_path = _checkpoint_path(config, log_file)
+
+    # Write and rename, so killed process never leaves broken checkpoint
+    tmp_path = f'{checkpoint_path}.tmp'
+    with open(tmp_path, 'wb') as checkpoint_file:
+        pickle.dump(checkpoint, checkpoint_file, pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, checkpoint_path)
+
+
+def aggregate_incrementally(
+        config: Config,
+        log_file: File,
+        make_aggregate: AggregateFactory,
+        checkpoint: Optional[Checkpoint] = None,
+        metrics: Optional[Metrics] = None,
+        monitor: Optional[FaultMonitor] = None,
+) -> LogAggregate:
+    metrics = metrics or Metrics()
+    log_file_path = os.path.join(config.LOG_DIR, log_file.name)
+    is_gzip = log_file.name.endswith('.gz')
+    if checkpoint is None:
+        checkpoint = Checkpoint(
+            log_name=log_file.name,
+            inode=os.stat(log_file_path).st_ino,
+            offset=0,
+            aggregate=make_aggregate(),
+        )
+    else:
+        logger.info(
+            'Resuming %s from offset %d', log_file.name, checkpoint.offset,
+        )
+
+    # Only lines parsed by this run are monitored
+    if monitor is not None:
+        monitor.first_line = checkpoint.aggregate.total_lines + 1
+
+    # Gzip stream can't be seeked, so processed part is decompressed again,
+    # but not parsed
+    start = 0 if is_gzip else checkpoint.offset
+    saved_offset = checkpoint.offset
+    chunks = read_log_chunks(log_file_path, start=start)
+    for chunk, offset in metrics.timed('read', chunks):
+        chunk_start = offset - len(chunk)
+
+        # Last line of a plain log may still be being written, it is left
+        # for the next run
+        if not is_gzip and not chunk.endswith(b'\n'):
+            offset = chunk_start + chunk.rfind(b'\n') + 1
+            chunk = chunk[:offset - chunk_start]
+
+        if offset <= checkpoint.offset:
+            continue
+
+        if chunk_start < checkpoint.offset:
+            chunk = chunk[checkpoint.offset - chunk_start:]
+
+        add_log_chunk(checkpoint.aggregate, chunk, metrics, monitor)
+        checkpoint.offset = offset
+
+        if offset - saved_offset >= config.CHECKPOINT_INTERVAL:
+            with metrics.stage('checkpoint'):
+                save_checkpoint(config, log_file, checkpoint)
+            saved_offset = offset
+
+    with metrics.stage('checkpoint'):
+        save_checkpoint(config, log_file, checkpoint)
+    return checkpoint.aggregate
@@ -0,0 +1,189 @@
+from __future__ import annotations
+
+from array import array
+from dataclasses import dataclass, field
+from typing import Any, Iterable
+
+from log_parser import RequestLog
+from quantiles import QuantileSketch
+from stats import QUANTILE_FIELDS, LogAggregate, RequestStat
+from urls import DistinctCounter
+
+try:
+    import numpy as np
+except ImportError:
+    np = None  # type: ignore
+
+
+@dataclass
+class ColumnarLogAggregate(LogAggregate):
+    # URLs are mapped to integer ids and every request is stored as a pair
+    # of (id, duration) in typed arrays, stats for all URLs are calculated
+    # at once with numpy. Quantiles are always exact, so the report is the
+    # same as of LogAggregate while it keeps every duration.
+    url_ids: dict[str, int] = field(default_factory=dict, repr=False)
+    urls: list[str] = field(default_factory=list, repr=False)
+    ids: array = field(default_factory=lambda: array('i'), repr=False)
+    durations: array = field(default_factory=lambda: array('d'), repr=False)
+    raw_urls: dict[int, DistinctCounter] = field(
+        default_factory=dict,
+        repr=False,
+    )
+
+    def __post_init__(self) -> None:
+        if np is None:
+            raise RuntimeError('numpy is required for numpy aggregator')
+
+    def add(self, request_log: RequestLog) -> None:
+        self.total_lines += 1
+
+        if not request_log.success:
+            self.failed_count += 1
+            return
+
+        self.add_request(request_log.request.name, request_log.duration)
+
+    def add_request(self, url: str, duration: float) -> None:
+        key = url if self.normalizer is None else self.normalizer(url)
+        url_id = self._get_url_id(key)
+
+        self.total_count += 1
+        self.total_duration += duration
+        self.ids.append(url_id)
+        self.durations.append(duration)
+        if self.normalizer is not None:
+            self.raw_urls.setdefault(url_id, DistinctCounter()).add(url)
+
+    def add_columns(self, urls: list[str], ids: Any, durations: Any) -> None:
+        # Requests given as numpy arrays of ids into urls and durations,
+        # every URL is normalized once
+        id_map = np.array(
+            [
+                self._get_url_id(
+                    url if self.normalizer is None else self.normalizer(url),
+                )
+                for url in urls
+            ],
+            dtype=np.int32,
+        )
+        if self.normalizer is not None:
+            for url, url_id in zip(urls, id_map.tolist()):
+                self.raw_urls.setdefault(url_id, DistinctCounter()).add(url)
+
+        self.total_count += len(ids)
+        self.total_duration += float(durations.sum(dtype=np.float64))
+        self.ids.frombytes(id_map[ids].tobytes())
+        self.durations.frombytes(durations.astype(np.float64).tobytes())
+
+    def merge(self, other: LogAggregate) -> None:
+        if not isinstance(other, ColumnarLogAggregate):
+            if other.request_stats:
+                raise ValueError(
+                    'numpy aggregator can not merge quantile sketches',
+                )
+            super().merge(other)
+            return
+
+        self.total_lines += other.total_lines
+        self.failed_count += other.failed_count
+        self.total_count += other.total_count
+        self.total_duration += other.total_duration
+
+        id_map = np.array(
+            [self._get_url_id(url) for url in other.urls],
+            dtype=np.int32,
+        )
+        other_ids = np.frombuffer(other.ids, dtype=np.int32)
+        self.ids.frombytes(id_map[other_ids].tobytes())
+        self.durations.extend(other.durations)
+        for other_id, counter in other.raw_urls.items():
+            url_id = int(id_map[other_id])
+            if url_id in self.raw_urls:
+                self.raw_urls[url_id].merge(counter)
+            else:
+                self.raw_urls[url_id] = counter
+
+    def get_request_stats(self) -> Iterable[RequestStat]:
+        for url_id, (url, durations) in enumerate(
+                zip(self.urls, self._split_durations()),
+        ):
+            request_stat = RequestStat(
+                url=url,
+                times=QuantileSketch(self.relative_error, self.exact_limit),
+                raw_urls=self.raw_urls.get(url_id),
+            )
+            for duration in durations.tolist():
+                request_stat.add(duration)
+            yield request_stat
+
+    def calculate_stats(self) -> list[RequestStat]:
+        if not self.urls:
+            return []
+
+        columns = self._calculate_columns()
+        squares_sums = columns.pop('squares_sum')
+        total_count, total_duration = self.estimate_totals()
+        request_stats = []
+        for url_id, url in enumerate(self.urls):
+            request_stat = RequestStat(
+                url=url,
+                raw_urls=self.raw_urls.get(url_id),
+            )
+            for name, column in columns.items():
+                setattr(request_stat, name, column[url_id])
+            if self.scales_request_stats:
+                request_stat.scale(self.sample_rate, squares_sums[url_id])
+            request_stat.round_stats(total_count, total_duration)
+            request_stats.append(request_stat)
+
+        return request_stats
+
+    def _get_url_id(self, url: str) -> int:
+        url_id = self.url_ids.get(url)
+        if url_id is None:
+            url_id = len(self.urls)
+            self.url_ids[url] = url_id
+            self.urls.append(url)
+
+        return url_id
+
+    def _sort(self) -> tuple[Any, Any, Any]:
+        ids = np.frombuffer(self.ids, dtype=np.int32)
+        durations = np.frombuffer(self.durations, dtype=np.float64)
+        counts = np.bincount(ids, minlength=len(self.urls))
+        order = np.lexsort((durations, ids))
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        return durations[order], counts, starts
+
+    def _split_durations(self) -> list[Any]:
+        sorted_durations, counts, starts = self._sort()
+        return np.split(sorted_durations, starts[1:])
+
+    def _calculate_columns(self) -> dict[str, list]:
+        ids = np.frombuffer(self.ids, dtype=np.int32)
+        durations = np.frombuffer(self.durations, dtype=np.float64)
+        sorted_durations, counts, starts = self._sort()
+
+        columns = {
+            'count': counts.tolist(),
+            # bincount adds weights in order, as the exact aggregator does
+            'time_sum': np.bincount(
+                ids, weights=durations, minlength=len(self.urls),
+            ).tolist(),
+            'time_max': np.maximum.reduceat(sorted_durations, starts).tolist(),
+            'squares_sum': np.bincount(
+                ids, weights=durations * durations, minlength=len(self.urls),
+            ).tolist(),
+        }
+        for name, q in QUANTILE_FIELDS.items():
+            # Same interpolation as QuantileSketch and statistics.median
+            rank = q * (counts - 1)
+            lower = np.floor(rank).astype(np.int64)
+            upper = np.minimum(lower + 1, counts - 1)
+            fraction = rank - lower
+            columns[name] = (
+                sorted_durations[starts + lower] * (1 - fraction)
+                + sorted_durations[starts + upper] * fraction
+            ).tolist()
+
+        return columns
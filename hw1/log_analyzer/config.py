@@ -1,5 +1,5 @@
 import json
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import Optional
 
 
@@ -9,6 +9,31 @@ class Config:
     REPORT_DIR: str = './reports'
     LOG_DIR: str = './log'
     SCRIPT_LOG_FILE: Optional[str] = None
+    WORKERS: int = 1
+    QUANTILE_ERROR: float = .01
+    QUANTILE_EXACT_LIMIT: int = 1000
+    INCREMENTAL: bool = False
+    CHECKPOINT_DIR: str = './checkpoints'
+    CHECKPOINT_INTERVAL: int = 64 << 20
+    BACKFILL: bool = False
+    BACKFILL_WORKERS: int = 4
+    STORE_PATH: Optional[str] = None
+    URL_TEMPLATES: bool = False
+    URL_STRIP_QUERY: bool = False
+    AGGREGATOR: str = 'exact'
+    TOP_K_CAPACITY: int = 10_000
+    METRICS_FILE: Optional[str] = None
+    MAX_FAULT_RATE: float = .5
+    FAULT_RATE_WARMUP: int = 1000
+    FOLLOW: bool = False
+    FOLLOW_INTERVAL: float = 10
+    FOLLOW_WINDOWS: list[int] = field(default_factory=lambda: [300, 3600])
+    SAMPLE_RATE: int = 1
+    SAMPLE_BY: str = 'line'
+    MANIFEST_PATH: Optional[str] = None
+    CACHE_DIR: Optional[str] = None
+    SOURCES: list[str] = field(default_factory=list)
+    REPORT_PAGE_SIZE: int = 0
 
 
 def parse_config(file_name: str) -> Config:
@@ -24,5 +49,55 @@ def parse_config(file_name: str) -> Config:
         config.LOG_DIR = config_dict['log_dir']
     if 'script_log_file' in config_dict:
         config.SCRIPT_LOG_FILE = config_dict['script_log_file']
+    if 'workers' in config_dict:
+        config.WORKERS = config_dict['workers']
+    if 'quantile_error' in config_dict:
+        config.QUANTILE_ERROR = config_dict['quantile_error']
+    if 'quantile_exact_limit' in config_dict:
+        config.QUANTILE_EXACT_LIMIT = config_dict['quantile_exact_limit']
+    if 'incremental' in config_dict:
+        config.INCREMENTAL = config_dict['incremental']
+    if 'checkpoint_dir' in config_dict:
+        config.CHECKPOINT_DIR = config_dict['checkpoint_dir']
+    if 'checkpoint_interval' in config_dict:
+        config.CHECKPOINT_INTERVAL = config_dict['checkpoint_interval']
+    if 'backfill' in config_dict:
+        config.BACKFILL = config_dict['backfill']
+    if 'backfill_workers' in config_dict:
+        config.BACKFILL_WORKERS = config_dict['backfill_workers']
+    if 'store_path' in config_dict:
+        config.STORE_PATH = config_dict['store_path']
+    if 'url_templates' in config_dict:
+        config.URL_TEMPLATES = config_dict['url_templates']
+    if 'url_strip_query' in config_dict:
+        config.URL_STRIP_QUERY = config_dict['url_strip_query']
+    if 'aggregator' in config_dict:
+        config.AGGREGATOR = config_dict['aggregator']
+    if 'top_k_capacity' in config_dict:
+        config.TOP_K_CAPACITY = config_dict['top_k_capacity']
+    if 'metrics_file' in config_dict:
+        config.METRICS_FILE = config_dict['metrics_file']
+    if 'max_fault_rate' in config_dict:
+        config.MAX_FAULT_RATE = config_dict['max_fault_rate']
+    if 'fault_rate_warmup' in config_dict:
+        config.FAULT_RATE_WARMUP = config_dict['fault_rate_warmup']
+    if 'follow' in config_dict:
+        config.FOLLOW = config_dict['follow']
+    if 'follow_interval' in config_dict:
+        config.FOLLOW_INTERVAL = config_dict['follow_interval']
+    if 'follow_windows' in config_dict:
+        config.FOLLOW_WINDOWS = config_dict['follow_windows']
+    if 'sample_rate' in config_dict:
+        config.SAMPLE_RATE = config_dict['sample_rate']
+    if 'sample_by' in config_dict:
+        config.SAMPLE_BY = config_dict['sample_by']
+    if 'manifest_path' in config_dict:
+        config.MANIFEST_PATH = config_dict['manifest_path']
+    if 'cache_dir' in config_dict:
+        config.CACHE_DIR = config_dict['cache_dir']
+    if 'sources' in config_dict:
+        config.SOURCES = config_dict['sources']
+    if 'report_page_size' in config_dict:
+        config.REPORT_PAGE_SIZE = config_dict['report_page_size']
 
     return config
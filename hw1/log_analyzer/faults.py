@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+import math
+from dataclasses import dataclass, field
+from typing import Optional
+
+from log_parser import RequestLog
+
+# One-sided z-score: abort only if the fault rate is above the limit with
+# about 99.9% confidence
+CONFIDENCE_Z = 3.
+SAMPLE_SIZE = 5
+
+
+class FaultRateExceeded(Exception):
+    def __init__(self, monitor: FaultMonitor) -> None:
+        super().__init__(monitor)
+        self.monitor = monitor
+
+    def __str__(self) -> str:
+        return self.monitor.describe()
+
+
+@dataclass
+class FaultMonitor:
+    # Watches fault rate while a log is being parsed. Line numbers start
+    # from first_line, failed lines up to sample_size are kept as samples
+    # with source, the log path when several sources are merged.
+    max_fault_rate: float = .5
+    warmup: int = 1000
+    first_line: int = 1
+    lines: int = 0
+    failed: int = 0
+    samples: list[tuple[str, int, bytes]] = field(default_factory=list)
+    source: str = ''
+    # Lines read including ones skipped by sampling, for line numbers
+    read_lines: int = 0
+
+    @property
+    def fault_rate(self) -> float:
+        return self.failed / self.lines if self.lines else 0
+
+    def lower_bound(self) -> float:
+        # Lower limit of Wilson score interval of the fault rate
+        if not self.lines:
+            return 0
+
+        z2 = CONFIDENCE_Z ** 2
+        rate = self.fault_rate
+        center = rate + z2 / (2 * self.lines)
+        spread = CONFIDENCE_Z * math.sqrt(
+            rate * (1 - rate) / self.lines + z2 / (4 * self.lines ** 2),
+        )
+        return (center - spread) / (1 + z2 / self.lines)
+
+    def add(
+            self,
+            lines: list[bytes],
+            request_logs: list[RequestLog],
+            indexes: Optional[list[int]] = None,
+    ) -> None:
+        # request_logs are parsed from lines at indexes (all lines if not
+        # sampled), failed lines are numbered by their place among all lines
+        first_line = self.first_line + self.read_lines
+        for index, request_log in zip(
+                range(len(lines)) if indexes is None else indexes,
+                request_logs,
+        ):
+            if not request_log.success:
+                self.failed += 1
+                if len(self.samples) < SAMPLE_SIZE:
+                    self.samples.append(
+                        (self.source, first_line + index, lines[index]),
+                    )
+
+        self.lines += len(request_logs)
+        self.read_lines += len(lines)
+
+    def merge(self, other: FaultMonitor) -> None:
+        self.lines += other.lines
+        self.failed += other.failed
+        self.read_lines += other.read_lines
+        self.samples = sorted(self.samples + other.samples)[:SAMPLE_SIZE]
+
+    def check(self) -> None:
+        if (
+                self.lines >= self.warmup
+                and self.lower_bound() > self.max_fault_rate
+        ):
+            raise FaultRateExceeded(self)
+
+    def describe(self) -> str:
+        samples = '; '.join(
+            f'{source + " " if source else ""}line {line_number}: '
+            f'{line[:200]!r}'
+            for source, line_number, line in self.samples
+        )
+        return (
+            f'{self.failed} of {self.lines} lines failed to parse '
+            f'(fault rate {self.fault_rate:.5f} > {self.max_fault_rate}), '
+            f'samples: {samples}'
+        )
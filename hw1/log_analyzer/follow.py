@@ -0,0 +1,201 @@
+import copy
+import json
+import logging
+import os
+import time
+from collections import deque
+from datetime import datetime
+from typing import BinaryIO, Callable, Generator, Optional
+
+from config import Config
+from log_parser import CHUNK_SIZE
+from metrics import Metrics
+from parallel import AggregateFactory, add_log_chunk
+from stats import LogAggregate
+
+FOLLOW_LOG_NAME = 'nginx-access-ui.log'
+SNAPSHOT_FILE_NAME = 'report-live.json'
+BUCKET_SIZE = 60
+POLL_INTERVAL = 1.
+
+logger = logging.getLogger(__name__)
+
+
+class LogFollower:
+    # Reads lines appended to a log like tail -F: after rotation (another
+    # inode under the same name) the rest of the old file is read and the new
+    # one is read from the start, after truncation the file is reread.
+    def __init__(self, path: str, from_start: bool = False) -> None:
+        self.path = path
+        self._file: Optional[BinaryIO] = None
+        self._inode = 0
+        self._tail = b''
+        self._open(from_start)
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def read_chunks(self) -> Generator[bytes, None, None]:
+        # Yields blocks of whole lines written since the previous call
+        while True:
+            if self._file is None and not self._open(from_start=True):
+                return
+
+            data = self._file.read(CHUNK_SIZE)  # type: ignore
+            if data:
+                block = self._tail + data
+                line_end = block.rfind(b'\n') + 1
+                self._tail = block[line_end:]
+                if line_end:
+                    yield block[:line_end]
+                continue
+
+            try:
+                stat = os.stat(self.path)
+            except FileNotFoundError:
+                return  # rotated, new file isn't created yet
+
+            if stat.st_ino != self._inode:
+                logger.info('%s was rotated, reopening', self.path)
+                if self._tail:
+                    yield self._tail
+                self.close()
+            elif stat.st_size < self._file.tell():  # type: ignore
+                logger.info('%s was truncated, reading from start', self.path)
+                self._file.seek(0)  # type: ignore
+                self._tail = b''
+            else:
+                return
+
+    def _open(self, from_start: bool) -> bool:
+        try:
+            self._file = open(self.path, 'rb')
+        except FileNotFoundError:
+            return False
+
+        self._inode = os.fstat(self._file.fileno()).st_ino
+        self._tail = b''
+        if not from_start:
+            self._file.seek(0, os.SEEK_END)
+        return True
+
+
+class RollingAggregate:
+    # Requests are aggregated into buckets of bucket_size seconds, only
+    # buckets of the longest window are kept, so memory is bounded by the
+    # number of buckets times the size of an aggregate
+    def __init__(
+            self,
+            make_aggregate: AggregateFactory,
+            windows: list[int],
+            bucket_size: int = BUCKET_SIZE,
+    ) -> None:
+        self.make_aggregate = make_aggregate
+        self.windows = windows
+        self.bucket_size = bucket_size
+        self.buckets: deque[tuple[int, LogAggregate]] = deque()
+
+    def add_chunk(
+            self,
+            chunk: bytes,
+            now: float,
+            metrics: Optional[Metrics] = None,
+    ) -> None:
+        bucket_start = int(now) // self.bucket_size * self.bucket_size
+        if not self.buckets or self.buckets[-1][0] != bucket_start:
+            self.buckets.append((bucket_start, self.make_aggregate()))
+        add_log_chunk(self.buckets[-1][1], chunk, metrics or Metrics())
+        self.expire(now)
+
+    def expire(self, now: float) -> None:
+        oldest = now - max(self.windows)
+        while self.buckets and self.buckets[0][0] + self.bucket_size <= oldest:
+            self.buckets.popleft()
+
+    def window(self, seconds: int, now: float) -> LogAggregate:
+        # Merging moves request stats into the target, so buckets are copied
+        aggregate = self.make_aggregate()
+        for bucket_start, bucket in self.buckets:
+            if bucket_start + self.bucket_size > now - seconds:
+                aggregate.merge(copy.deepcopy(bucket))
+
+        return aggregate
+
+
+def _window_name(seconds: int) -> str:
+    if seconds % 3600 == 0:
+        return f'{seconds // 3600}h'
+    if seconds % 60 == 0:
+        return f'{seconds // 60}m'
+    return f'{seconds}s'
+
+
+def save_snapshot(
+        config: Config,
+        rolling: RollingAggregate,
+        now: float,
+) -> str:
+    windows = {}
+    for seconds in rolling.windows:
+        aggregate = rolling.window(seconds, now)
+        request_stats = sorted(
+            aggregate.calculate_stats(),
+            key=lambda s: s.time_sum,
+            reverse=True,
+        )[:config.REPORT_SIZE]
+        windows[_window_name(seconds)] = {
+            'total_lines': aggregate.total_lines,
+            'total_count': aggregate.total_count,
+            'fault_rate': round(aggregate.fault_rate, 5),
+            'requests': [
+                request_stat.to_dict() for request_stat in request_stats
+            ],
+        }
+
+    os.makedirs(config.REPORT_DIR, exist_ok=True)
+    snapshot_path = os.path.join(config.REPORT_DIR, SNAPSHOT_FILE_NAME)
+    tmp_path = f'{snapshot_path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as snapshot_file:
+        json.dump(
+            {
+                'updated': datetime.fromtimestamp(now).isoformat(
+                    timespec='seconds',
+                ),
+                'windows': windows,
+            },
+            snapshot_file,
+        )
+    os.replace(tmp_path, snapshot_path)
+    return snapshot_path
+
+
+def follow(
+        config: Config,
+        make_aggregate: AggregateFactory,
+        should_stop: Callable[[], bool] = lambda: False,
+        clock: Callable[[], float] = time.time,
+        poll_interval: float = POLL_INTERVAL,
+) -> None:
+    log_path = os.path.join(config.LOG_DIR, FOLLOW_LOG_NAME)
+    follower = LogFollower(log_path)
+    rolling = RollingAggregate(make_aggregate, config.FOLLOW_WINDOWS)
+    next_snapshot = clock() + config.FOLLOW_INTERVAL
+    logger.info('Following %s', log_path)
+    try:
+        while not should_stop():
+            for chunk in follower.read_chunks():
+                rolling.add_chunk(chunk, clock())
+
+            now = clock()
+            if now >= next_snapshot:
+                rolling.expire(now)
+                save_snapshot(config, rolling, now)
+                next_snapshot = now + config.FOLLOW_INTERVAL
+
+            time.sleep(poll_interval)
+    except KeyboardInterrupt:
+        logger.info('Stopped following %s', log_path)
+    finally:
+        follower.close()
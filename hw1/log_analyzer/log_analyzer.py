@@ -3,106 +3,425 @@ import argparse
 import json
 import logging
 import os
-from dataclasses import asdict, dataclass, field
-from statistics import median
+import shutil
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import replace
+from datetime import datetime
+from functools import partial
+from itertools import islice
 from string import Template
-from typing import Generator
+from typing import Any, Generator, Iterator, Optional
 
+from cache import aggregate_cached
+from checkpoint import aggregate_incrementally, load_checkpoint
+from columnar import ColumnarLogAggregate
 from config import Config, parse_config
-from log_parser import File, RequestLog, get_next_log_file, read_log_lines
+from faults import FaultMonitor, FaultRateExceeded
+from follow import follow
+from log_parser import (SAMPLE_BY, File, RequestLog, get_latest_log_file,
+                        get_next_log_file, get_source_files,
+                        get_unreported_log_files, has_report)
+from manifest import Manifest
+from metrics import Metrics, profile, save_metrics
+from parallel import (AggregateFactory, aggregate_log_file,
+                      aggregate_request_logs, aggregate_sources)
+from stats import LogAggregate, RequestStat, TopKLogAggregate
+from store import get_missing_days, load_range, save_day
+from urls import UrlNormalizer
 
+REPORT_TEMPLATE = os.path.join(os.path.dirname(__file__), 'report.html')
+REPORT_PAGED_TEMPLATE = os.path.join(
+    os.path.dirname(__file__), 'report_paged.html',
+)
+REPORT_CHUNK_PREFIX = 'chunk-'
 
-@dataclass
-class RequestStat:
-    url: str
-    count: int = 0
-    count_perc: float = 0
-    times: list[float] = field(default_factory=lambda: [])
-    time_sum: float = 0
-    time_perc: float = 0
-    time_avg: float = 0
-    time_max: float = 0
-    time_med: float = 0
+logger = logging.getLogger(__name__)
 
-    def calculate_stats(self, total_count: int, total_duration: float) -> None:
-        precision = 3
 
-        self.count_perc = round(self.count / total_count * 100, precision)
-        self.time_max = round(max(self.times), precision)
-        self.time_sum = round(sum(self.times), precision)
-        self.time_avg = round(self.time_sum / self.count, precision)
-        self.time_perc = round(self.time_sum / total_duration * 100, precision)
-        self.time_med = round(median(self.times), precision)
+def get_report_file_name(log_file: File) -> str:
+    return f'report-{log_file.date.strftime("%Y%m%d")}.html'
+
+
+def get_report_columns(row: dict[str, Any]) -> list[str]:
+    # Same order as the report script: sorted, the last one (url) first
+    columns = sorted(row)
+    return columns[-1:] + columns[:-1]
+
+
+def save_paged_result(
+        config: Config,
+        rows: Iterator[dict[str, Any]],
+        report_file_name: str,
+) -> None:
+    # Rows are written as they come, page by page, into data files next to
+    # the report. Data files are scripts calling reportChunk(page, rows),
+    # so the page can load them from disk without a web server.
+    data_dir_name = f'{os.path.splitext(report_file_name)[0]}.data'
+    data_dir = os.path.join(config.REPORT_DIR, data_dir_name)
+    shutil.rmtree(data_dir, ignore_errors=True)
+    os.makedirs(data_dir)
+
+    columns: list[str] = []
+    pages = rows_count = 0
+    while True:
+        page_rows = list(islice(rows, config.REPORT_PAGE_SIZE))
+        if not page_rows:
+            break
+
+        columns = columns or get_report_columns(page_rows[0])
+        chunk_path = os.path.join(
+            data_dir, f'{REPORT_CHUNK_PREFIX}{pages:05d}.js',
+        )
+        with open(chunk_path, 'w', encoding='utf-8') as chunk_file:
+            chunk_file.write(f'reportChunk({pages}, ')
+            json.dump(page_rows, chunk_file)
+            chunk_file.write(');\n')
+        pages += 1
+        rows_count += len(page_rows)
+
+    report_index = {
+        'columns': columns,
+        'rows': rows_count,
+        'page_size': config.REPORT_PAGE_SIZE,
+        'pages': pages,
+        'data': data_dir_name,
+        'chunk_prefix': REPORT_CHUNK_PREFIX,
+    }
+    with open(REPORT_PAGED_TEMPLATE, 'r', encoding='utf-8') as template_file:
+        template = Template(template_file.read())
+    report_full_path = os.path.join(config.REPORT_DIR, report_file_name)
+    with open(report_full_path, 'w', encoding='utf-8') as result_file:
+        result_file.write(
+            template.safe_substitute(report_index=json.dumps(report_index)),
+        )
 
 
 def save_result(
         config: Config,
         request_stats: list[RequestStat],
-        log_file: File,
+        report_file_name: str,
+        metrics: Optional[Metrics] = None,
 ) -> None:
-    with open('report.html', 'r', encoding='utf-8') as template_file:
-        template = Template(template_file.read())
+    metrics = metrics or Metrics()
+    with metrics.stage('sort'):
         result_stats = sorted(
             request_stats,
             key=lambda s: s.time_sum,
             reverse=True
         )[:config.REPORT_SIZE]
 
-        results = []
-        for result_stat in result_stats:
-            result_stat_dict = asdict(result_stat)
-            result_stat_dict.pop('times')
-            results.append(result_stat_dict)
+    os.makedirs(config.REPORT_DIR, exist_ok=True)
+    if config.REPORT_PAGE_SIZE:
+        with metrics.stage('write'):
+            save_paged_result(
+                config,
+                (result_stat.to_dict() for result_stat in result_stats),
+                report_file_name,
+            )
+        return
 
-        result_table = template.safe_substitute(table_json=json.dumps(results))
+    with open(REPORT_TEMPLATE, 'r', encoding='utf-8') as template_file:
+        template = Template(template_file.read())
+    with metrics.stage('render'):
+        results = [result_stat.to_dict() for result_stat in result_stats]
+
+        result_table = template.safe_substitute(
+            table_json=json.dumps(results),
+        )
 
-    report_file_name = f'report-{log_file.date.strftime("%Y%m%d")}.html'
     report_full_path = os.path.join(config.REPORT_DIR, report_file_name)
-    with open(report_full_path, 'w', encoding='utf-8') as result_file:
-        result_file.write(result_table)
+    with metrics.stage('write'):
+        with open(report_full_path, 'w', encoding='utf-8') as result_file:
+            result_file.write(result_table)
+
+
+def get_aggregate_factory(config: Config) -> AggregateFactory:
+    normalizer = None
+    if config.URL_TEMPLATES:
+        normalizer = UrlNormalizer(strip_query=config.URL_STRIP_QUERY)
+    if config.SAMPLE_BY not in SAMPLE_BY:
+        raise ValueError(f'Unknown sample_by {config.SAMPLE_BY}')
+    if config.SAMPLE_RATE < 1:
+        raise ValueError(f'Wrong sample_rate {config.SAMPLE_RATE}')
+
+    if config.AGGREGATOR == 'exact':
+        return partial(
+            LogAggregate,
+            relative_error=config.QUANTILE_ERROR,
+            exact_limit=config.QUANTILE_EXACT_LIMIT,
+            normalizer=normalizer,
+            sample_rate=config.SAMPLE_RATE,
+            sample_by=config.SAMPLE_BY,
+        )
+    if config.AGGREGATOR == 'topk':
+        return partial(
+            TopKLogAggregate,
+            relative_error=config.QUANTILE_ERROR,
+            exact_limit=config.QUANTILE_EXACT_LIMIT,
+            normalizer=normalizer,
+            capacity=config.TOP_K_CAPACITY,
+            sample_rate=config.SAMPLE_RATE,
+            sample_by=config.SAMPLE_BY,
+        )
+
+    if config.AGGREGATOR == 'numpy':
+        return partial(
+            ColumnarLogAggregate,
+            normalizer=normalizer,
+            sample_rate=config.SAMPLE_RATE,
+            sample_by=config.SAMPLE_BY,
+        )
+
+    raise ValueError(f'Unknown aggregator {config.AGGREGATOR}')
 
 
 def process_request_logs(
         request_logs: Generator[RequestLog, None, None],
+        sample_rate: int = 1,
+        sample_by: str = 'line',
 ) -> tuple[list[RequestStat], float]:
-    total_count = 0
-    total_lines = 0
-    total_duration = .0
-    failed_count = 0
-    request_stats: dict[str, RequestStat] = {}
+    # Request logs must be already sampled with the same parameters,
+    # e.g. by read_log_lines
+    aggregate = aggregate_request_logs(
+        request_logs,
+        partial(LogAggregate, sample_rate=sample_rate, sample_by=sample_by),
+    )
+    return aggregate.calculate_stats(), aggregate.fault_rate
 
-    for request_log in request_logs:
-        total_lines += 1
 
-        if not request_log.success:
-            failed_count += 1
-            continue
+def get_incremental_log_file(config: Config) -> Optional[File]:
+    manifest = Manifest(config.MANIFEST_PATH)
+    log_file = get_latest_log_file(config, manifest)
+    if log_file is None:
+        return None
 
-        if request_log.request.name not in request_stats:
-            request_stat = RequestStat(url=request_log.request.name)
-            request_stats[request_log.request.name] = request_stat
-        else:
-            request_stat = request_stats[request_log.request.name]
+    # Report without a checkpoint was built by a full run, nothing to resume
+    checkpoint = load_checkpoint(config, log_file)
+    if checkpoint is None and has_report(config, log_file, manifest):
+        return None
+
+    return log_file
+
+
+def save_aggregate(
+        config: Config,
+        aggregate: LogAggregate,
+        log_file: File,
+        metrics: Optional[Metrics] = None,
+) -> None:
+    metrics = metrics or Metrics()
+    if config.STORE_PATH and aggregate.sample_rate > 1:
+        logger.warning('%s: sampled aggregates are not stored', log_file.name)
+    elif config.STORE_PATH:
+        with metrics.stage('store'):
+            save_day(config.STORE_PATH, log_file.date, aggregate)
 
-        total_count += 1
-        request_stat.count += 1
+    with metrics.stage('calculate'):
+        request_stats = aggregate.calculate_stats()
+    metrics.count('distinct_urls', len(request_stats))
 
-        total_duration += request_log.duration
-        request_stat.times.append(request_log.duration)
+    save_result(
+        config,
+        request_stats,
+        get_report_file_name(log_file),
+        metrics,
+    )
 
-    for request_stat in request_stats.values():
-        request_stat.calculate_stats(total_count, total_duration)
 
-    fault_rate = failed_count / total_lines if total_lines else 0
-    return list(request_stats.values()), fault_rate
+def build_range_report(config: Config, date_range: str) -> None:
+    if not config.STORE_PATH:
+        raise ValueError('store_path must be set to build range reports')
+    if config.AGGREGATOR == 'numpy':
+        # Stored quantile sketches can't be merged into columnar arrays
+        raise ValueError("Range reports can't be built with numpy aggregator")
+
+    start, end = (
+        datetime.strptime(date, '%Y%m%d') for date in date_range.split(':')
+    )
+    missing_days = get_missing_days(config.STORE_PATH, start, end)
+    if missing_days:
+        logger.warning(
+            'No stored aggregates for %s',
+            ', '.join(day.strftime('%Y%m%d') for day in missing_days),
+        )
+
+    # Stored aggregates are never sampled
+    aggregate = load_range(
+        config.STORE_PATH,
+        start,
+        end,
+        get_aggregate_factory(replace(config, SAMPLE_RATE=1)),
+    )
+    save_result(
+        config,
+        aggregate.calculate_stats(),
+        f'report-{date_range.replace(":", "-")}.html',
+    )
+
+
+def aggregate_log_sources(
+        config: Config,
+        sources: list[str],
+        metrics: Metrics,
+        monitor: FaultMonitor,
+) -> LogAggregate:
+    workers = config.WORKERS if config.WORKERS > 1 else os.cpu_count() or 1
+    aggregate, source_counts = aggregate_sources(
+        sources,
+        workers,
+        get_aggregate_factory(config),
+        metrics,
+        monitor,
+    )
+    for source in sources:
+        lines, failed_count = source_counts[source]
+        logger.info(
+            'Source %s: %d lines, %d failed (fault rate %.5f)',
+            source,
+            lines,
+            failed_count,
+            failed_count / lines if lines else 0,
+        )
+
+    return aggregate
+
+
+def analyze_log_file(
+        config: Config,
+        log_file: File,
+        profile_path: Optional[str] = None,
+        sources: Optional[list[str]] = None,
+) -> float:
+    # Saves report unless fault rate is too high, returns fault rate.
+    # With sources set they are analyzed as one log instead of log_file.
+    metrics = Metrics()
+    monitor = FaultMonitor(config.MAX_FAULT_RATE, config.FAULT_RATE_WARMUP)
+    try:
+        with profile(profile_path):
+            if sources:
+                aggregate = aggregate_log_sources(
+                    config, sources, metrics, monitor,
+                )
+            elif config.INCREMENTAL:
+                aggregate = aggregate_incrementally(
+                    config,
+                    log_file,
+                    get_aggregate_factory(config),
+                    load_checkpoint(config, log_file),
+                    metrics,
+                    monitor,
+                )
+            elif config.CACHE_DIR and config.SAMPLE_RATE == 1:
+                aggregate = aggregate_cached(
+                    config,
+                    log_file,
+                    get_aggregate_factory(config),
+                    metrics,
+                    monitor,
+                )
+            else:
+                aggregate = aggregate_log_file(
+                    os.path.join(config.LOG_DIR, log_file.name),
+                    config.WORKERS,
+                    get_aggregate_factory(config),
+                    metrics,
+                    monitor,
+                )
+    except FaultRateExceeded as e:
+        logger.error('%s: parsing aborted, %s', log_file.name, e)
+        fault_rate = e.monitor.fault_rate
+    else:
+        fault_rate = aggregate.fault_rate
+        if fault_rate <= config.MAX_FAULT_RATE:
+            save_aggregate(config, aggregate, log_file, metrics)
+
+    logger.info('%s metrics: %s', log_file.name, metrics.summary())
+    if config.METRICS_FILE:
+        save_metrics(config.METRICS_FILE, log_file.name, metrics)
+
+    return fault_rate
+
+
+def backfill(config: Config) -> None:
+    log_files = get_unreported_log_files(config)
+    logger.info('Backfilling %d log files', len(log_files))
+
+    failed_count = 0
+    with ProcessPoolExecutor(max_workers=config.BACKFILL_WORKERS) as executor:
+        futures = {
+            executor.submit(analyze_log_file, config, log_file): log_file
+            for log_file in log_files
+        }
+        for future in as_completed(futures):
+            log_file = futures[future]
+            try:
+                fault_rate = future.result()
+            except Exception:
+                failed_count += 1
+                logger.exception('Failed to process %s', log_file.name)
+                continue
+
+            logger.info('%s: fault rate is %.5f', log_file.name, fault_rate)
+            if fault_rate > config.MAX_FAULT_RATE:
+                failed_count += 1
+                logger.error(
+                    '%s: fault rate is too high, report is not saved',
+                    log_file.name,
+                )
+
+    logger.info(
+        'Backfill finished, %d of %d files failed',
+        failed_count,
+        len(log_files),
+    )
 
 
 def main() -> None:
     parser = argparse.ArgumentParser()
     parser.add_argument('--config', dest='config', default='config.json')
+    parser.add_argument('--workers', dest='workers', type=int)
+    parser.add_argument(
+        '--incremental',
+        dest='incremental',
+        action='store_true',
+        default=None,
+    )
+    parser.add_argument(
+        '--backfill',
+        dest='backfill',
+        action='store_true',
+        default=None,
+    )
+    parser.add_argument(
+        '--follow',
+        dest='follow',
+        action='store_true',
+        default=None,
+    )
+    parser.add_argument('--range', dest='date_range')
+    parser.add_argument('--sample-rate', dest='sample_rate', type=int)
+    parser.add_argument('--sources', dest='sources', nargs='+')
+    parser.add_argument(
+        '--profile',
+        dest='profile',
+        nargs='?',
+        const='log_analyzer.pstats',
+    )
     args = parser.parse_args()
 
     config = parse_config(args.config)
+    if args.workers is not None:
+        config.WORKERS = args.workers
+    if args.incremental is not None:
+        config.INCREMENTAL = args.incremental
+    if args.backfill is not None:
+        config.BACKFILL = args.backfill
+    if args.follow is not None:
+        config.FOLLOW = args.follow
+    if args.sample_rate is not None:
+        config.SAMPLE_RATE = args.sample_rate
+    if args.sources is not None:
+        config.SOURCES = args.sources
 
     logging.basicConfig(
         format='[%(asctime)s] %(levelname)1s %(message)s',
@@ -111,27 +430,40 @@ def main() -> None:
         filename=config.SCRIPT_LOG_FILE,
     )
 
-    logger = logging.getLogger(__name__)
     logger.info(config)
 
     try:
-        next_log_file = get_next_log_file(config)
+        if args.date_range is not None:
+            build_range_report(config, args.date_range)
+            return
+
+        if config.BACKFILL:
+            backfill(config)
+            return
+
+        if config.FOLLOW:
+            follow(config, get_aggregate_factory(config))
+            return
+
+        next_log_file: Optional[File]
+        sources = None
+        if config.SOURCES:
+            next_log_file, sources = get_source_files(config.SOURCES)
+        elif config.INCREMENTAL:
+            next_log_file = get_incremental_log_file(config)
+        else:
+            next_log_file = get_next_log_file(config)
         if next_log_file is None:
             logger.info('no new files were found, finishing.')
             return
 
-        log_file_path = os.path.join(config.LOG_DIR, next_log_file.name)
-        request_logs = read_log_lines(log_file_path)
-
-        request_stats, fault_rate = process_request_logs(
-            request_logs=request_logs,
+        fault_rate = analyze_log_file(
+            config, next_log_file, args.profile, sources,
         )
+
         logger.info('Fault rate is %.5f', fault_rate)
-        if fault_rate > .5:
+        if fault_rate > config.MAX_FAULT_RATE:
             logger.error('Fault rate is too high, finishing.')
-            return
-
-        save_result(config, request_stats, next_log_file)
     except Exception as e:
         logger.exception(e)
 
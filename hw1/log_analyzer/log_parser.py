@@ -1,22 +1,38 @@
 from __future__ import annotations
 
+import glob
 import gzip
+import mmap
 import os
+import queue
 import re
+import shutil
+import subprocess
+import sys
+import threading
+import zlib
 from dataclasses import dataclass, field
 from datetime import datetime
-from typing import Callable, Generator, Optional
+from functools import lru_cache
+from typing import IO, Generator, Iterable, Optional, Union
 
 from config import Config
+from manifest import Manifest
 
 file_date_regexp = re.compile(r'\d+')
 log_format_regexp = re.compile(
-    r'^nginx-access-ui\.log-\d+(\.txt|\.log|\.gz)?$',
+    r'^nginx-access-ui\.log-(?P<date>\d+)(\.txt|\.log|\.gz)?$',
 )
-report_format_regexp = re.compile(r'^report-*')
+report_format_regexp = re.compile(r'^report-(?P<date>\d{8})\.html$')
 request_regexp = re.compile(r'".*?"')
 request_duration_regexp = re.compile(r'[.\d]*$')
 
+CHUNK_SIZE = 1 << 20
+# Decompressed blocks handed over from the decompressor thread to the reader
+PIPELINE_DEPTH = 4
+GZIP_TOOLS = ('pigz', 'zcat')
+SAMPLE_BY = ('line', 'url')
+
 
 @dataclass
 class File:
@@ -47,30 +63,103 @@ class RequestLog:
     success: bool = True
 
 
-def _get_files_in_path(path: str) -> Generator[File, None, None]:
-    for name in os.listdir(path):
-        if os.path.isfile(os.path.join(path, name)):
-            yield File.from_file_name(name)
+def _date_from_key(date: str) -> datetime:
+    # Dates in the manifest are already validated, strptime is much slower
+    return datetime(int(date[:4]), int(date[4:6]), int(date[6:]))
 
 
-def get_next_log_file(config: Config) -> Optional[File]:
-    last_log_file: Optional[File] = None
-    for log_file in _get_files_in_path(config.LOG_DIR):
-        if not re.match(log_format_regexp, log_file.name):
-            continue
+def _get_files_in_path(
+        path: str,
+        name_regexp: re.Pattern,
+        manifest: Manifest,
+) -> list[File]:
+    return [
+        File(name=name, date=_date_from_key(date))
+        for name, date in manifest.list_dates(path, name_regexp).items()
+    ]
+
 
+def get_latest_log_file(
+        config: Config,
+        manifest: Optional[Manifest] = None,
+) -> Optional[File]:
+    manifest = manifest or Manifest(config.MANIFEST_PATH)
+    last_log_file: Optional[File] = None
+    for log_file in _get_files_in_path(
+            config.LOG_DIR, log_format_regexp, manifest,
+    ):
         if last_log_file is None or last_log_file.date < log_file.date:
             last_log_file = log_file
 
-    if last_log_file is None:
-        return None
+    return last_log_file
+
 
+def get_report_dates(
+        config: Config,
+        manifest: Optional[Manifest] = None,
+) -> set[datetime]:
     os.makedirs(config.REPORT_DIR, exist_ok=True)
+    manifest = manifest or Manifest(config.MANIFEST_PATH)
+    return {
+        report_file.date
+        for report_file in _get_files_in_path(
+            config.REPORT_DIR, report_format_regexp, manifest,
+        )
+    }
+
+
+def has_report(
+        config: Config,
+        log_file: File,
+        manifest: Optional[Manifest] = None,
+) -> bool:
+    return log_file.date in get_report_dates(config, manifest)
+
+
+def get_unreported_log_files(config: Config) -> list[File]:
+    manifest = Manifest(config.MANIFEST_PATH)
+    reported_dates = get_report_dates(config, manifest)
+
+    log_files: dict[datetime, File] = {}
+    for log_file in _get_files_in_path(
+            config.LOG_DIR, log_format_regexp, manifest,
+    ):
+        if log_file.date not in reported_dates:
+            log_files.setdefault(log_file.date, log_file)
+
+    return sorted(log_files.values(), key=lambda f: f.date)
+
+
+def get_source_files(patterns: list[str]) -> tuple[File, list[str]]:
+    # Logs of the same date from several hosts, given as paths or globs.
+    # Returned File describes them all in reports.
+    paths = sorted({
+        path
+        for pattern in patterns
+        for path in (glob.glob(pattern) or [pattern])
+    })
+    dates = set()
+    for path in paths:
+        match = re.match(log_format_regexp, os.path.basename(path))
+        if match is None:
+            raise ValueError(f'{path} is not a log file')
+        dates.add(match.group('date'))
+
+    if len(dates) != 1:
+        raise ValueError(f'Sources must be logs of one date, got {dates}')
+
+    return File.from_file_name(os.path.basename(paths[0])), paths
+
+
+def get_next_log_file(config: Config) -> Optional[File]:
+    manifest = Manifest(config.MANIFEST_PATH)
+    last_log_file = get_latest_log_file(config, manifest)
+    if last_log_file is None:
+        return None
 
     # If report for this date already exists, skip this log file
-    for report_file in _get_files_in_path(config.REPORT_DIR):
-        if last_log_file.date == report_file.date:
-            return None
+    if has_report(config, last_log_file, manifest):
+        return None
 
     return last_log_file
 
@@ -95,14 +184,292 @@ def parse_log_line(log_line: str) -> RequestLog:
     )
 
 
-def read_log_lines(file_name: str) -> Generator[RequestLog, None, None]:
-    open_func: Callable = open
+def _parse_log_line_slow(log_line: bytes) -> RequestLog:
+    return parse_log_line(log_line.decode('utf-8'))
+
+
+@lru_cache(maxsize=64)
+def _decode_token(token: bytes) -> str:
+    return token.decode('utf-8')
+
+
+def parse_log_line_fast(log_line: bytes) -> RequestLog:
+    # Single pass over raw bytes for well-formed lines: request is the first
+    # quoted field and duration is the last field. Anything unusual is handed
+    # over to the regexp based parser, so results are the same.
+    request_start = log_line.find(b'"') + 1
+    request_end = log_line.find(b'"', request_start)
+    duration_start = log_line.rfind(b' ') + 1
+    if not request_start or request_end < 0 or request_end >= duration_start:
+        return _parse_log_line_slow(log_line)
+
+    request = log_line[request_start:request_end].split()
+    duration = log_line[duration_start:].rstrip()
+    if (
+            len(request) != 3
+            or not duration
+            or duration.translate(None, b'.0123456789')
+    ):
+        return _parse_log_line_slow(log_line)
+
+    try:
+        return RequestLog(
+            request=Request(
+                method=_decode_token(request[0]),
+                name=sys.intern(request[1].decode('utf-8')),
+                http_version=_decode_token(request[2]),
+            ),
+            duration=float(duration),
+        )
+    except ValueError:
+        return _parse_log_line_slow(log_line)
+
+
+def parse_log_lines(
+        lines: Iterable[bytes],
+) -> Generator[RequestLog, None, None]:
+    for line in lines:
+        try:
+            yield parse_log_line_fast(line)
+        except ValueError:
+            yield RequestLog(success=False)
+
+
+def _sample_key(line: bytes, sample_by: str) -> bytes:
+    if sample_by == 'url':
+        request_start = line.find(b'"') + 1
+        request_end = line.find(b'"', request_start)
+        if request_start and request_end > 0:
+            request = line[request_start:request_end].split()
+            if len(request) == 3:
+                return request[1]
+
+    # Lines without URL are sampled by the whole line, so the fault rate
+    # is not skewed
+    return line
+
+
+def sample_line_indexes(
+        lines: list[bytes],
+        sample_rate: int,
+        sample_by: str = 'line',
+) -> list[int]:
+    # Keeps 1 in sample_rate lines (or URLs) before they are parsed. crc32 is
+    # the same in every run and process, so samples are reproducible.
+    return [
+        index for index, line in enumerate(lines)
+        if zlib.crc32(_sample_key(line, sample_by)) % sample_rate == 0
+    ]
+
+
+def sample_lines(
+        lines: list[bytes],
+        sample_rate: int,
+        sample_by: str = 'line',
+) -> list[bytes]:
+    return [
+        lines[index]
+        for index in sample_line_indexes(lines, sample_rate, sample_by)
+    ]
+
+
+def split_log_file(file_name: str, parts: int) -> list[tuple[int, int]]:
+    # Byte ranges are aligned on line boundaries, so every line belongs
+    # to exactly one range
+    size = os.path.getsize(file_name)
+    boundaries = [0]
+    with open(file_name, 'rb') as log_file:
+        for part in range(1, parts):
+            log_file.seek(max(size * part // parts, boundaries[-1]))
+            log_file.readline()
+            boundaries.append(min(log_file.tell(), size))
+
+    boundaries.append(size)
+    return [
+        (start, end)
+        for start, end in zip(boundaries, boundaries[1:])
+        if start < end
+    ]
+
+
+def split_chunk(chunk: bytes) -> list[bytes]:
+    lines = chunk.split(b'\n')
+    if not lines[-1]:
+        lines.pop()
+
+    return lines
+
+
+def _read_plain_chunks(
+        file_name: str,
+        start: int,
+        end: Optional[int],
+        chunk_size: int,
+) -> Generator[tuple[bytes, int], None, None]:
+    with open(file_name, 'rb') as log_file:
+        size = os.fstat(log_file.fileno()).st_size
+        end = size if end is None else min(end, size)
+        if start >= end:
+            return
+
+        with mmap.mmap(log_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            position = start
+            while position < end:
+                chunk_end = min(position + chunk_size, end)
+                if chunk_end < end:
+                    line_end = data.rfind(b'\n', position, chunk_end)
+                    if line_end < 0:
+                        line_end = data.find(b'\n', chunk_end, end)
+                    chunk_end = end if line_end < 0 else line_end + 1
+
+                yield data[position:chunk_end], chunk_end
+                position = chunk_end
+
+
+@lru_cache(maxsize=1)
+def find_gzip_tool() -> Optional[str]:
+    for tool in GZIP_TOOLS:
+        if shutil.which(tool):
+            return tool
+
+    return None
+
+
+def _put_block(
+        blocks: queue.Queue,
+        stop: threading.Event,
+        block: Union[bytes, Exception],
+) -> bool:
+    # Reader may stop early, then the decompressor must not block forever
+    while not stop.is_set():
+        try:
+            blocks.put(block, timeout=.1)
+            return True
+        except queue.Full:
+            continue
+
+    return False
+
+
+def _decompress_blocks(
+        file_name: str,
+        chunk_size: int,
+        tool: Optional[str],
+        blocks: queue.Queue,
+        stop: threading.Event,
+) -> None:
+    process: Optional[subprocess.Popen] = None
+    try:
+        stream: Union[gzip.GzipFile, IO[bytes]]
+        if tool is None:
+            stream = gzip.open(file_name, 'rb')
+        else:
+            process = subprocess.Popen(
+                [tool, '-dc', file_name],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+            )
+            stream = process.stdout  # type: ignore
+
+        with stream:
+            while True:
+                block = stream.read(chunk_size)
+                if not block:
+                    break
+                if not _put_block(blocks, stop, block):
+                    return
+
+        if process is not None and process.wait():
+            error = process.stderr.read().decode(  # type: ignore
+                'utf-8', 'replace',
+            )
+            raise OSError(f'{tool} failed on {file_name}: {error.strip()}')
+
+        _put_block(blocks, stop, b'')
+    except Exception as e:
+        _put_block(blocks, stop, e)
+    finally:
+        if process is not None:
+            if process.poll() is None:
+                process.kill()
+            process.wait()
+            process.stderr.close()  # type: ignore
+
+
+def read_gzip_blocks(
+        file_name: str,
+        chunk_size: int,
+        tool: Optional[str] = None,
+        depth: int = PIPELINE_DEPTH,
+) -> Generator[bytes, None, None]:
+    # Decompression runs in a thread (zlib releases the GIL) or in an external
+    # zcat/pigz process, while the caller parses previous blocks. The queue
+    # is bounded, so at most depth blocks are kept in memory.
+    blocks: queue.Queue = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    decompressor = threading.Thread(
+        target=_decompress_blocks,
+        args=(file_name, chunk_size, tool, blocks, stop),
+        daemon=True,
+    )
+    decompressor.start()
+    try:
+        while True:
+            block = blocks.get()
+            if isinstance(block, Exception):
+                raise block
+            if not block:
+                return
+            yield block
+    finally:
+        stop.set()
+        decompressor.join()
+
+
+def _read_gzip_chunks(
+        file_name: str,
+        chunk_size: int,
+) -> Generator[tuple[bytes, int], None, None]:
+    position = 0
+    tail = b''
+    for block in read_gzip_blocks(file_name, chunk_size, find_gzip_tool()):
+        block = tail + block
+        line_end = block.rfind(b'\n') + 1
+        if not line_end:
+            tail = block
+            continue
+
+        tail = block[line_end:]
+        position += line_end
+        yield block[:line_end], position
+
+    if tail:
+        yield tail, position + len(tail)
+
+
+def read_log_chunks(
+        file_name: str,
+        start: int = 0,
+        end: Optional[int] = None,
+        chunk_size: int = CHUNK_SIZE,
+) -> Generator[tuple[bytes, int], None, None]:
+    # Yields blocks of whole lines together with the offset right after the
+    # block (in the decompressed stream for .gz). Nothing is decoded here.
     if file_name.endswith('.gz'):
-        open_func = gzip.open
-
-    with open_func(file_name, 'rt', encoding='utf-8') as log_file:
-        for line in log_file:
-            try:
-                yield parse_log_line(line)
-            except ValueError:
-                yield RequestLog(success=False)
+        yield from _read_gzip_chunks(file_name, chunk_size)
+    else:
+        yield from _read_plain_chunks(file_name, start, end, chunk_size)
+
+
+def read_log_lines(
+        file_name: str,
+        start: int = 0,
+        end: Optional[int] = None,
+        sample_rate: int = 1,
+        sample_by: str = 'line',
+) -> Generator[RequestLog, None, None]:
+    for chunk, _ in read_log_chunks(file_name, start, end):
+        lines = split_chunk(chunk)
+        if sample_rate > 1:
+            lines = sample_lines(lines, sample_rate, sample_by)
+        yield from parse_log_lines(lines)
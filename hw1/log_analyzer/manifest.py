@@ -0,0 +1,79 @@
+import json
+import os
+import re
+import time
+from datetime import datetime
+from typing import Any, Optional
+
+# Directory listed less than this before its mtime was taken could be
+# changed again within the same mtime tick, so it is listed again next time
+MTIME_RESOLUTION_NS = 2_000_000_000
+
+
+def _is_valid_date(date: str) -> bool:
+    try:
+        datetime.strptime(date, '%Y%m%d')
+    except ValueError:
+        return False
+
+    return True
+
+
+class Manifest:
+    # Dates of files matching a pattern in every scanned directory. A
+    # directory is listed again only when its mtime changes (an entry was
+    # added, removed or renamed), and only names not seen before are parsed.
+    # With path set the manifest is kept between runs.
+    def __init__(self, path: Optional[str] = None) -> None:
+        self.path = path
+        self.directories: dict[str, dict[str, Any]] = {}
+        if path is not None and os.path.exists(path):
+            with open(path, encoding='utf-8') as manifest_file:
+                self.directories = json.load(manifest_file)
+
+    def list_dates(self, directory: str, name_regexp: re.Pattern) -> dict:
+        # Maps names of matching files to their dates, YYYYMMDD. The date is
+        # the 'date' group of name_regexp.
+        key = f'{os.path.abspath(directory)}:{name_regexp.pattern}'
+        mtime_ns = os.stat(directory).st_mtime_ns
+        cached = self.directories.get(key)
+        if (
+                cached is not None
+                and cached['mtime_ns'] == mtime_ns
+                and cached['scanned_ns'] - mtime_ns > MTIME_RESOLUTION_NS
+        ):
+            return cached['dates']
+
+        known_dates = cached['dates'] if cached is not None else {}
+        scanned_ns = time.time_ns()
+        dates = {}
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.name in known_dates:
+                    dates[entry.name] = known_dates[entry.name]
+                    continue
+
+                match = name_regexp.match(entry.name)
+                if (
+                        match is not None
+                        and _is_valid_date(match.group('date'))
+                        and entry.is_file()
+                ):
+                    dates[entry.name] = match.group('date')
+
+        self.directories[key] = {
+            'mtime_ns': mtime_ns,
+            'scanned_ns': scanned_ns,
+            'dates': dates,
+        }
+        self.save()
+        return dates
+
+    def save(self) -> None:
+        if self.path is None:
+            return
+
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as manifest_file:
+            json.dump(self.directories, manifest_file)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,125 @@
+import cProfile
+import json
+import platform
+import resource
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from typing import Any, Iterable, Iterator, Optional, TypeVar
+
+T = TypeVar('T')
+
+# Stages of a single pass over a log, lines/sec is calculated over them.
+# In parallel mode the whole pass is timed as one 'process' stage.
+PASS_STAGES = ('read', 'parse', 'aggregate')
+
+
+@dataclass
+class StageTiming:
+    wall: float = 0
+    cpu: float = 0
+    calls: int = 0
+
+
+@dataclass
+class Metrics:
+    stages: dict[str, StageTiming] = field(default_factory=dict)
+    counters: dict[str, int] = field(default_factory=dict)
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        # CPU time is of this process only, workers are not included
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            timing = self.stages.setdefault(name, StageTiming())
+            timing.wall += time.perf_counter() - wall_start
+            timing.cpu += time.process_time() - cpu_start
+            timing.calls += 1
+
+    def timed(self, name: str, iterable: Iterable[T]) -> Iterator[T]:
+        # Time spent inside the iterable itself goes to the stage
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def count(self, name: str, value: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    @property
+    def lines_per_sec(self) -> Optional[float]:
+        if 'process' in self.stages:
+            wall = self.stages['process'].wall
+        else:
+            wall = sum(
+                self.stages[name].wall
+                for name in PASS_STAGES
+                if name in self.stages
+            )
+        if not wall:
+            return None
+
+        return self.counters.get('lines', 0) / wall
+
+    @staticmethod
+    def peak_rss_kb() -> int:
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak_rss // 1024 if platform.system() == 'Darwin' else peak_rss
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            'stages': {
+                name: asdict(timing) for name, timing in self.stages.items()
+            },
+            'counters': self.counters,
+            'lines_per_sec': self.lines_per_sec,
+            'peak_rss_kb': self.peak_rss_kb(),
+        }
+
+    def summary(self) -> str:
+        stages = ', '.join(
+            f'{name} {timing.wall:.3f}s (cpu {timing.cpu:.3f}s)'
+            for name, timing in self.stages.items()
+        )
+        counters = ', '.join(
+            f'{name} {value}' for name, value in self.counters.items()
+        )
+        return (
+            f'stages: {stages}; {counters}; '
+            f'lines/sec {self.lines_per_sec or 0:.0f}; '
+            f'peak RSS {self.peak_rss_kb()} KB'
+        )
+
+
+@contextmanager
+def profile(profile_path: Optional[str]) -> Iterator[None]:
+    if profile_path is None:
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(profile_path)
+
+
+def save_metrics(
+        metrics_path: str,
+        log_name: str,
+        metrics: Metrics,
+) -> None:
+    # One JSON object per analyzed log
+    with open(metrics_path, 'a', encoding='utf-8') as metrics_file:
+        metrics_file.write(json.dumps({'log': log_name, **metrics.to_dict()}))
+        metrics_file.write('\n')
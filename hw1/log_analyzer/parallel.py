@@ -0,0 +1,319 @@
+import os
+from collections import deque
+from concurrent.futures import (FIRST_COMPLETED, Future, ProcessPoolExecutor,
+                                wait)
+from dataclasses import replace
+from typing import Callable, Generator, Iterable, Optional
+
+from faults import FaultMonitor, FaultRateExceeded
+from log_parser import (RequestLog, parse_log_lines, read_log_chunks,
+                        sample_line_indexes, split_chunk, split_log_file)
+from metrics import Metrics
+from stats import LogAggregate
+
+GZIP_CHUNK_SIZE = 8 << 20
+RANGE_SIZE = 32 << 20
+
+AggregateFactory = Callable[[], LogAggregate]
+RangeResult = tuple[str, LogAggregate, Optional[FaultMonitor], int]
+
+
+def aggregate_request_logs(
+        request_logs: Iterable,
+        make_aggregate: AggregateFactory = LogAggregate,
+) -> LogAggregate:
+    aggregate = make_aggregate()
+    for request_log in request_logs:
+        aggregate.add(request_log)
+
+    return aggregate
+
+
+def _parse_chunk(
+        aggregate: LogAggregate,
+        chunk: bytes,
+) -> tuple[list[bytes], Optional[list[int]], list[RequestLog]]:
+    # Returns all lines of the chunk, indexes of sampled lines (None if not
+    # sampled) and parsed sampled lines
+    lines = split_chunk(chunk)
+    if aggregate.sample_rate <= 1:
+        return lines, None, list(parse_log_lines(lines))
+
+    indexes = sample_line_indexes(
+        lines, aggregate.sample_rate, aggregate.sample_by,
+    )
+    sampled = [lines[index] for index in indexes]
+    return lines, indexes, list(parse_log_lines(sampled))
+
+
+def add_log_chunk(
+        aggregate: LogAggregate,
+        chunk: bytes,
+        metrics: Metrics,
+        monitor: Optional[FaultMonitor] = None,
+) -> None:
+    with metrics.stage('parse'):
+        lines, indexes, request_logs = _parse_chunk(aggregate, chunk)
+    with metrics.stage('aggregate'):
+        for request_log in request_logs:
+            aggregate.add(request_log)
+
+    metrics.count('lines', len(request_logs))
+    metrics.count('bytes', len(chunk))
+    if monitor is not None:
+        monitor.add(lines, request_logs, indexes)
+        monitor.check()
+
+
+def _count_faults(
+        aggregate: LogAggregate,
+        chunk: bytes,
+        monitor: Optional[FaultMonitor],
+) -> None:
+    # Used by workers: a part of the log is too small to judge the whole
+    # log, so the fault rate is checked only after merging
+    lines, indexes, request_logs = _parse_chunk(aggregate, chunk)
+    for request_log in request_logs:
+        aggregate.add(request_log)
+    if monitor is not None:
+        monitor.add(lines, request_logs, indexes)
+
+
+def _aggregate_range(
+        file_name: str,
+        start: int,
+        end: Optional[int],
+        make_aggregate: AggregateFactory,
+        monitor: Optional[FaultMonitor],
+) -> tuple[LogAggregate, Optional[FaultMonitor], int]:
+    # Returns number of lines in the range too, so line numbers of failed
+    # lines can be shifted when ranges are merged in order
+    aggregate = make_aggregate()
+    lines = 0
+    for chunk, _ in read_log_chunks(file_name, start, end):
+        _count_faults(aggregate, chunk, monitor)
+        lines += chunk.count(b'\n')
+
+    return aggregate, monitor, lines
+
+
+def _aggregate_chunk(
+        chunk: bytes,
+        make_aggregate: AggregateFactory,
+        monitor: Optional[FaultMonitor],
+) -> tuple[LogAggregate, Optional[FaultMonitor]]:
+    aggregate = make_aggregate()
+    _count_faults(aggregate, chunk, monitor)
+    return aggregate, monitor
+
+
+def _start_workers(executor: ProcessPoolExecutor, workers: int) -> None:
+    # Executor starts worker processes on demand, so every worker is given
+    # a no-op task and all of them are waited for
+    wait([executor.submit(int) for _ in range(workers)])
+
+
+def _merge_done(
+        aggregate: LogAggregate,
+        monitor: Optional[FaultMonitor],
+        futures: set[Future],
+) -> set[Future]:
+    done, pending = wait(futures, return_when=FIRST_COMPLETED)
+    for future in done:
+        partial_aggregate, partial_monitor = future.result()
+        aggregate.merge(partial_aggregate)
+        if monitor is not None and partial_monitor is not None:
+            monitor.merge(partial_monitor)
+
+    if monitor is not None:
+        monitor.check()
+    return pending
+
+
+def _split_ranges(
+        file_name: str,
+        parts: int,
+) -> list[tuple[int, Optional[int]]]:
+    # Plain logs are split into ranges of about RANGE_SIZE bytes, but not
+    # less than parts, so the fault rate is checked while the log is read.
+    # Gzip stream can't be split and is read whole.
+    if file_name.endswith('.gz'):
+        return [(0, None)]
+
+    parts = max(parts, os.path.getsize(file_name) // RANGE_SIZE)
+    return list(split_log_file(file_name, parts))
+
+
+def _aggregate_ranges(
+        executor: ProcessPoolExecutor,
+        ranges: Iterable[tuple[str, int, Optional[int]]],
+        make_aggregate: AggregateFactory,
+        monitor: Optional[FaultMonitor],
+        workers: int,
+) -> Generator[RangeResult, None, None]:
+    # Yields results in the order of ranges, so line numbers of failed
+    # lines follow from line counts of the ranges before. Number of ranges
+    # in flight is bounded to keep memory usage flat.
+    pending: deque[tuple[str, Future]] = deque()
+    for file_name, start, end in ranges:
+        if len(pending) >= workers * 2:
+            done_name, future = pending.popleft()
+            yield (done_name, *future.result())
+
+        range_monitor = monitor and replace(
+            monitor, first_line=0, lines=0, failed=0, samples=[],
+            read_lines=0,
+        )
+        pending.append((file_name, executor.submit(
+            _aggregate_range,
+            file_name,
+            start,
+            end,
+            make_aggregate,
+            range_monitor,
+        )))
+
+    while pending:
+        done_name, future = pending.popleft()
+        yield (done_name, *future.result())
+
+
+def _merge_range(
+        monitor: Optional[FaultMonitor],
+        range_monitor: Optional[FaultMonitor],
+        first_line: int,
+        source: str = '',
+) -> None:
+    # Failed lines of a range are numbered from 0 by the worker. Samples
+    # are marked with source when several sources are merged.
+    if monitor is None or range_monitor is None:
+        return
+
+    range_monitor.samples = [
+        (source, first_line + line_number, line)
+        for _, line_number, line in range_monitor.samples
+    ]
+    monitor.merge(range_monitor)
+    monitor.check()
+
+
+def aggregate_log_file(
+        file_name: str,
+        workers: int = 1,
+        make_aggregate: AggregateFactory = LogAggregate,
+        metrics: Optional[Metrics] = None,
+        monitor: Optional[FaultMonitor] = None,
+) -> LogAggregate:
+    # make_aggregate is sent to worker processes, so it must be picklable
+    # (a class or a functools.partial, not a lambda). With monitor set,
+    # FaultRateExceeded is raised as soon as the fault rate is too high.
+    metrics = metrics or Metrics()
+    aggregate = make_aggregate()
+    if workers <= 1:
+        for chunk, _ in metrics.timed('read', read_log_chunks(file_name)):
+            add_log_chunk(aggregate, chunk, metrics, monitor)
+
+        return aggregate
+
+    # Workers parse and aggregate in other processes, so only the whole
+    # pass is timed
+    with metrics.stage('process'), ProcessPoolExecutor(
+            max_workers=workers,
+    ) as executor:
+        futures: set[Future] = set()
+        try:
+            if file_name.endswith('.gz'):
+                # Gzip stream can't be split, so it is decompressed here and
+                # parsing is spread across workers. Number of chunks in
+                # flight is bounded to keep memory usage flat. Workers are
+                # started before the decompressor thread, so they are not
+                # forked while it runs.
+                _start_workers(executor, workers)
+                chunks = read_log_chunks(
+                    file_name, chunk_size=GZIP_CHUNK_SIZE,
+                )
+                first_line = 1
+                for chunk, _ in metrics.timed('read', chunks):
+                    if len(futures) >= workers * 2:
+                        futures = _merge_done(aggregate, monitor, futures)
+
+                    chunk_monitor = monitor and replace(
+                        monitor, first_line=first_line, lines=0, failed=0,
+                        samples=[], read_lines=0,
+                    )
+                    first_line += chunk.count(b'\n')
+                    metrics.count('bytes', len(chunk))
+                    futures.add(executor.submit(
+                        _aggregate_chunk, chunk, make_aggregate, chunk_monitor,
+                    ))
+            else:
+                # Workers only count faults, the fault rate is checked here
+                # on merged counts, so the result doesn't depend on the
+                # number of workers
+                first_line = 1
+                ranges = (
+                    (file_name, start, end)
+                    for start, end in _split_ranges(file_name, workers)
+                )
+                metrics.count('bytes', os.path.getsize(file_name))
+                for _, partial, range_monitor, lines in _aggregate_ranges(
+                        executor, ranges, make_aggregate, monitor, workers,
+                ):
+                    aggregate.merge(partial)
+                    _merge_range(monitor, range_monitor, first_line)
+                    first_line += lines
+
+            while futures:
+                futures = _merge_done(aggregate, monitor, futures)
+        except FaultRateExceeded:
+            executor.shutdown(cancel_futures=True)
+            raise
+
+    metrics.count('lines', aggregate.total_lines)
+    return aggregate
+
+
+def aggregate_sources(
+        file_names: list[str],
+        workers: int,
+        make_aggregate: AggregateFactory = LogAggregate,
+        metrics: Optional[Metrics] = None,
+        monitor: Optional[FaultMonitor] = None,
+) -> tuple[LogAggregate, dict[str, tuple[int, int]]]:
+    # Sources are split into ranges like a single log, partial aggregates
+    # are merged into one and the fault rate is checked on the merged
+    # counts. Returns it with lines and failed lines of every source.
+    metrics = metrics or Metrics()
+    aggregate = make_aggregate()
+    source_counts = {file_name: (0, 0) for file_name in file_names}
+    first_lines = {file_name: 1 for file_name in file_names}
+    ranges = (
+        (file_name, start, end)
+        for file_name in file_names
+        for start, end in _split_ranges(file_name, 1)
+    )
+    with metrics.stage('process'), ProcessPoolExecutor(
+            max_workers=max(1, workers),
+    ) as executor:
+        try:
+            for file_name, partial, range_monitor, lines in _aggregate_ranges(
+                    executor, ranges, make_aggregate, monitor, workers,
+            ):
+                total_lines, failed_count = source_counts[file_name]
+                source_counts[file_name] = (
+                    total_lines + partial.total_lines,
+                    failed_count + partial.failed_count,
+                )
+                aggregate.merge(partial)
+                _merge_range(
+                    monitor, range_monitor, first_lines[file_name], file_name,
+                )
+                first_lines[file_name] += lines
+        except FaultRateExceeded:
+            executor.shutdown(cancel_futures=True)
+            raise
+
+    for file_name in file_names:
+        metrics.count('bytes', os.path.getsize(file_name))
+    metrics.count('lines', aggregate.total_lines)
+    return aggregate, source_counts
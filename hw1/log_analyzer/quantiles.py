@@ -0,0 +1,153 @@
+from __future__ import annotations
+
+import math
+import struct
+from array import array
+from typing import Optional
+
+# relative error, exact limit, count, zero count, stored items, is exact
+_HEADER = struct.Struct('<dIQQQ?')
+
+
+class QuantileSketch:
+    # Log-bucketed histogram: every value is put into a bucket
+    # [gamma^(k-1), gamma^k), so any quantile is estimated with relative error
+    # not greater than relative_error, and memory depends on the number of
+    # buckets only. While there are no more than exact_limit values they
+    # are stored as is and quantiles are exact.
+    def __init__(
+            self,
+            relative_error: float = .01,
+            exact_limit: int = 1000,
+    ) -> None:
+        if not 0 < relative_error < 1:
+            raise ValueError('relative_error must be in (0, 1)')
+
+        self.relative_error = relative_error
+        self.exact_limit = exact_limit
+        self.count = 0
+        self._gamma = (1 + relative_error) / (1 - relative_error)
+        self._log_gamma = math.log(self._gamma)
+        self._values: Optional[list[float]] = []
+        self._buckets: dict[int, int] = {}
+        self._zero_count = 0
+
+    @property
+    def is_exact(self) -> bool:
+        return self._values is not None
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        if self._values is not None:
+            self._values.append(value)
+            if len(self._values) > self.exact_limit:
+                self._to_buckets()
+        else:
+            self._add_to_bucket(value, 1)
+
+    def merge(self, other: QuantileSketch) -> None:
+        if self._gamma != other._gamma:
+            raise ValueError('Can not merge sketches with different errors')
+
+        self.count += other.count
+        if other._values is not None:
+            if self._values is not None:
+                self._values.extend(other._values)
+                if len(self._values) > self.exact_limit:
+                    self._to_buckets()
+            else:
+                for value in other._values:
+                    self._add_to_bucket(value, 1)
+            return
+
+        if self._values is not None:
+            self._to_buckets()
+
+        self._zero_count += other._zero_count
+        for key, count in other._buckets.items():
+            self._buckets[key] = self._buckets.get(key, 0) + count
+
+    def quantile(self, q: float) -> float:
+        if not self.count:
+            raise ValueError('Quantile of an empty sketch')
+
+        rank = q * (self.count - 1)
+        if self._values is not None:
+            # Same interpolation as statistics.median for q = 0.5
+            self._values.sort()
+            lower = math.floor(rank)
+            upper = min(lower + 1, self.count - 1)
+            fraction = rank - lower
+            return (
+                self._values[lower] * (1 - fraction)
+                + self._values[upper] * fraction
+            )
+
+        seen = self._zero_count
+        if rank < seen:
+            return .0
+
+        for key in sorted(self._buckets):
+            seen += self._buckets[key]
+            if rank < seen:
+                return 2 * self._gamma ** key / (self._gamma + 1)
+
+        return 2 * self._gamma ** max(self._buckets) / (self._gamma + 1)
+
+    def squares_sum(self) -> float:
+        # Sum of squared values, with relative error about 2 * relative_error
+        # when values are in buckets
+        if self._values is not None:
+            return sum(value * value for value in self._values)
+
+        return sum(
+            (2 * self._gamma ** key / (self._gamma + 1)) ** 2 * count
+            for key, count in self._buckets.items()
+        )
+
+    def to_bytes(self) -> bytes:
+        header = (self.relative_error, self.exact_limit, self.count)
+        if self._values is not None:
+            values = array('d', self._values)
+            return _HEADER.pack(
+                *header, self._zero_count, len(values), True,
+            ) + values.tobytes()
+
+        keys = array('q', self._buckets.keys())
+        counts = array('Q', self._buckets.values())
+        return _HEADER.pack(
+            *header, self._zero_count, len(keys), False,
+        ) + keys.tobytes() + counts.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> QuantileSketch:
+        (
+            relative_error, exact_limit, count, zero_count, size, is_exact,
+        ) = _HEADER.unpack_from(data)
+        sketch = cls(relative_error, exact_limit)
+        sketch.count = count
+        sketch._zero_count = zero_count
+
+        body = data[_HEADER.size:]
+        if is_exact:
+            sketch._values = array('d', body).tolist()
+        else:
+            sketch._values = None
+            keys = array('q', body[:size * 8])
+            counts = array('Q', body[size * 8:])
+            sketch._buckets = dict(zip(keys, counts))
+
+        return sketch
+
+    def _add_to_bucket(self, value: float, count: int) -> None:
+        if value <= 0:
+            self._zero_count += count
+            return
+
+        key = math.ceil(math.log(value) / self._log_gamma)
+        self._buckets[key] = self._buckets.get(key, 0) + count
+
+    def _to_buckets(self) -> None:
+        values, self._values = self._values or [], None
+        for value in values:
+            self._add_to_bucket(value, 1)
@@ -0,0 +1,323 @@
+from __future__ import annotations
+
+import heapq
+import math
+from dataclasses import dataclass, field, fields
+from typing import Any, Iterable, Optional
+
+from log_parser import RequestLog
+from quantiles import QuantileSketch
+from urls import DistinctCounter, UrlNormalizer
+
+QUANTILE_FIELDS = {
+    'time_med': .5,
+    'time_p90': .9,
+    'time_p95': .95,
+    'time_p99': .99,
+}
+# z-score of 95% confidence intervals of sampled runs
+SAMPLE_CONFIDENCE_Z = 1.96
+
+
+@dataclass
+class RequestStat:
+    url: str
+    count: int = 0
+    count_perc: float = 0
+    times: QuantileSketch = field(default_factory=QuantileSketch)
+    time_sum: float = 0
+    time_perc: float = 0
+    time_avg: float = 0
+    time_max: float = 0
+    time_med: float = 0
+    time_p90: float = 0
+    time_p95: float = 0
+    time_p99: float = 0
+    # Only set when URLs are normalized into templates
+    raw_urls: Optional[DistinctCounter] = None
+    raw_url_count: Optional[int] = None
+    # Only set by approximate top-k aggregation: count and time_sum may be
+    # overestimated by no more than these values
+    count_error: Optional[int] = None
+    time_sum_error: Optional[float] = None
+    # Only set for sampled runs: half-widths of 95% confidence intervals
+    # of count and time_sum
+    count_ci: Optional[int] = None
+    time_sum_ci: Optional[float] = None
+
+    def add(self, duration: float) -> None:
+        self.count += 1
+        self.time_sum += duration
+        self.time_max = max(self.time_max, duration)
+        self.times.add(duration)
+
+    def merge(self, other: RequestStat) -> None:
+        self.count += other.count
+        self.time_sum += other.time_sum
+        self.time_max = max(self.time_max, other.time_max)
+        self.times.merge(other.times)
+        if self.raw_urls is not None and other.raw_urls is not None:
+            self.raw_urls.merge(other.raw_urls)
+        if other.count_error is not None:
+            self.count_error = (self.count_error or 0) + other.count_error
+        if other.time_sum_error is not None:
+            self.time_sum_error = (
+                (self.time_sum_error or 0) + other.time_sum_error
+            )
+
+    def scale(self, sample_rate: int, squares_sum: float) -> None:
+        # Every line was kept with probability 1 / sample_rate, so sums are
+        # multiplied by sample_rate and the variance of such an estimate is
+        # sample_rate * (sample_rate - 1) * sum of sampled squares
+        variance_factor = sample_rate * (sample_rate - 1)
+        self.count_ci = round(
+            SAMPLE_CONFIDENCE_Z * math.sqrt(variance_factor * self.count),
+        )
+        self.time_sum_ci = SAMPLE_CONFIDENCE_Z * math.sqrt(
+            variance_factor * squares_sum,
+        )
+        self.count *= sample_rate
+        self.time_sum *= sample_rate
+        if self.count_error is not None:
+            self.count_error *= sample_rate
+        if self.time_sum_error is not None:
+            self.time_sum_error *= sample_rate
+
+    def calculate_stats(self, total_count: int, total_duration: float) -> None:
+        for name, q in QUANTILE_FIELDS.items():
+            setattr(self, name, self.times.quantile(q))
+
+        self.round_stats(total_count, total_duration)
+
+    def round_stats(self, total_count: int, total_duration: float) -> None:
+        precision = 3
+
+        self.count_perc = round(self.count / total_count * 100, precision)
+        self.time_max = round(self.time_max, precision)
+        self.time_sum = round(self.time_sum, precision)
+        self.time_avg = round(self.time_sum / self.count, precision)
+        self.time_perc = round(self.time_sum / total_duration * 100, precision)
+        for name in QUANTILE_FIELDS:
+            setattr(self, name, round(getattr(self, name), precision))
+        if self.raw_urls is not None:
+            self.raw_url_count = self.raw_urls.estimate()
+        if self.time_sum_error is not None:
+            self.time_sum_error = round(self.time_sum_error, precision)
+        if self.time_sum_ci is not None:
+            self.time_sum_ci = round(self.time_sum_ci, precision)
+
+    def to_dict(self) -> dict[str, Any]:
+        # Optional stats are reported only when they are calculated
+        return {
+            stat_field.name: getattr(self, stat_field.name)
+            for stat_field in fields(self)
+            if stat_field.name not in ('times', 'raw_urls')
+            and getattr(self, stat_field.name) is not None
+        }
+
+
+@dataclass
+class LogAggregate:
+    relative_error: float = .01
+    exact_limit: int = 1000
+    normalizer: Optional[UrlNormalizer] = None
+    total_lines: int = 0
+    failed_count: int = 0
+    total_count: int = 0
+    total_duration: float = .0
+    request_stats: dict[str, RequestStat] = field(default_factory=dict)
+    # 1 in sample_rate lines (or URLs, see log_parser.sample_lines) are
+    # aggregated, stats are scaled back up by calculate_stats
+    sample_rate: int = 1
+    sample_by: str = 'line'
+
+    @property
+    def fault_rate(self) -> float:
+        if not self.total_lines:
+            return 0
+
+        return self.failed_count / self.total_lines
+
+    def add(self, request_log: RequestLog) -> None:
+        self.total_lines += 1
+
+        if not request_log.success:
+            self.failed_count += 1
+            return
+
+        self.add_request(request_log.request.name, request_log.duration)
+
+    def add_request(self, url: str, duration: float) -> None:
+        # Successfully parsed line, total_lines is counted by the caller
+        key = url if self.normalizer is None else self.normalizer(url)
+        request_stat = self.request_stats.get(key)
+        if request_stat is None:
+            request_stat = RequestStat(
+                url=key,
+                times=QuantileSketch(self.relative_error, self.exact_limit),
+            )
+            if self.normalizer is not None:
+                request_stat.raw_urls = DistinctCounter()
+            self.merge_request_stat(request_stat)
+
+        self.total_count += 1
+        self.total_duration += duration
+        request_stat.add(duration)
+        if request_stat.raw_urls is not None:
+            request_stat.raw_urls.add(url)
+
+    def merge(self, other: LogAggregate) -> None:
+        self.total_lines += other.total_lines
+        self.failed_count += other.failed_count
+        self.total_count += other.total_count
+        self.total_duration += other.total_duration
+
+        for other_stat in other.request_stats.values():
+            self.merge_request_stat(other_stat)
+
+    def merge_request_stat(self, other_stat: RequestStat) -> None:
+        request_stat = self.request_stats.get(other_stat.url)
+        if request_stat is None:
+            self.request_stats[other_stat.url] = other_stat
+        else:
+            request_stat.merge(other_stat)
+
+    def get_request_stats(self) -> Iterable[RequestStat]:
+        # Stats before calculate_stats, with raw sums and quantile sketches
+        return self.request_stats.values()
+
+    @property
+    def scales_request_stats(self) -> bool:
+        # Stats of a URL sampled by URL are complete, unless it is a template
+        # of several sampled URLs
+        return self.sample_rate > 1 and (
+            self.sample_by == 'line' or self.normalizer is not None
+        )
+
+    def estimate_totals(self) -> tuple[int, float]:
+        return (
+            self.total_count * self.sample_rate,
+            self.total_duration * self.sample_rate,
+        )
+
+    def calculate_stats(self) -> list[RequestStat]:
+        total_count, total_duration = self.estimate_totals()
+        for request_stat in self.request_stats.values():
+            if self.scales_request_stats:
+                request_stat.scale(
+                    self.sample_rate,
+                    request_stat.times.squares_sum(),
+                )
+            request_stat.calculate_stats(total_count, total_duration)
+
+        return list(self.request_stats.values())
+
+
+@dataclass
+class TopKLogAggregate(LogAggregate):
+    # Space-saving: no more than capacity URLs are tracked. A new URL takes
+    # place of the one with the smallest time_sum and inherits its count and
+    # time_sum as an error, so heavy hitters are never lost and their stats
+    # are overestimated by no more than the reported errors.
+    capacity: int = 10_000
+    _heap: list[tuple[float, str]] = field(default_factory=list, repr=False)
+
+    def merge_request_stat(self, other_stat: RequestStat) -> None:
+        if other_stat.url in self.request_stats:
+            super().merge_request_stat(other_stat)
+            return
+
+        other_stat.count_error = other_stat.count_error or 0
+        other_stat.time_sum_error = other_stat.time_sum_error or 0
+        if len(self.request_stats) >= self.capacity:
+            evicted = self._pop_min()
+            other_stat.count += evicted.count
+            other_stat.count_error += evicted.count
+            other_stat.time_sum += evicted.time_sum
+            other_stat.time_sum_error += evicted.time_sum
+
+        self.request_stats[other_stat.url] = other_stat
+        heapq.heappush(self._heap, (other_stat.time_sum, other_stat.url))
+
+    def merge(self, other: LogAggregate) -> None:
+        # Mergeable space-saving: a URL missing from a full summary may have
+        # been dropped from it with up to its smallest count and time_sum, so
+        # these are added to the stats and errors of the URL on the other
+        # side. Then only capacity URLs with the largest time_sum are kept.
+        own_floor = self._floor()
+        other_floor = (
+            other._floor() if isinstance(other, TopKLogAggregate) else (0, 0.)
+        )
+        for url, own_stat in self.request_stats.items():
+            if url not in other.request_stats:
+                _add_error(own_stat, *other_floor)
+        for url, other_stat in other.request_stats.items():
+            if url not in self.request_stats:
+                _add_error(other_stat, *own_floor)
+
+        self.total_lines += other.total_lines
+        self.failed_count += other.failed_count
+        self.total_count += other.total_count
+        self.total_duration += other.total_duration
+        for url, other_stat in other.request_stats.items():
+            request_stat = self.request_stats.get(url)
+            if request_stat is None:
+                self.request_stats[url] = other_stat
+            else:
+                request_stat.merge(other_stat)
+
+        if len(self.request_stats) > self.capacity:
+            self.request_stats = {
+                request_stat.url: request_stat
+                for request_stat in heapq.nlargest(
+                    self.capacity,
+                    self.request_stats.values(),
+                    key=lambda request_stat: request_stat.time_sum,
+                )
+            }
+        self._heap = [
+            (request_stat.time_sum, url)
+            for url, request_stat in self.request_stats.items()
+        ]
+        heapq.heapify(self._heap)
+
+    def _floor(self) -> tuple[int, float]:
+        # Upper bound of stats of a URL that isn't tracked
+        if len(self.request_stats) < self.capacity:
+            return 0, 0.
+
+        return (
+            min(stat.count for stat in self.request_stats.values()),
+            min(stat.time_sum for stat in self.request_stats.values()),
+        )
+
+    def _pop_min(self) -> RequestStat:
+        # Heap is updated lazily: time_sum only grows, so an outdated entry
+        # is pushed back with the current value when it reaches the top
+        if len(self._heap) > 2 * self.capacity:
+            self._heap = [
+                (request_stat.time_sum, url)
+                for url, request_stat in self.request_stats.items()
+            ]
+            heapq.heapify(self._heap)
+
+        while True:
+            time_sum, url = heapq.heappop(self._heap)
+            request_stat = self.request_stats.get(url)
+            if request_stat is None:
+                continue
+
+            if request_stat.time_sum != time_sum:
+                heapq.heappush(self._heap, (request_stat.time_sum, url))
+                continue
+
+            return self.request_stats.pop(url)
+
+
+def _add_error(request_stat: RequestStat, count: int, time_sum: float) -> None:
+    request_stat.count += count
+    request_stat.count_error = (request_stat.count_error or 0) + count
+    request_stat.time_sum += time_sum
+    request_stat.time_sum_error = (
+        (request_stat.time_sum_error or 0) + time_sum
+    )
@@ -0,0 +1,139 @@
+import sqlite3
+from contextlib import closing
+from datetime import datetime, timedelta
+from itertools import groupby
+from operator import itemgetter
+
+from parallel import AggregateFactory
+from quantiles import QuantileSketch
+from stats import LogAggregate, RequestStat
+from urls import DistinctCounter
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS days (
+    date TEXT PRIMARY KEY,
+    total_lines INTEGER NOT NULL,
+    failed_count INTEGER NOT NULL,
+    total_count INTEGER NOT NULL,
+    total_duration REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS request_stats (
+    date TEXT NOT NULL,
+    url TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    time_sum REAL NOT NULL,
+    time_max REAL NOT NULL,
+    times BLOB NOT NULL,
+    raw_urls BLOB,
+    PRIMARY KEY (date, url)
+);
+'''
+
+
+def _connect(store_path: str) -> sqlite3.Connection:
+    # Backfill workers write to the same store concurrently
+    connection = sqlite3.connect(store_path, timeout=60)
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def _date_key(date: datetime) -> str:
+    return date.strftime('%Y%m%d')
+
+
+def save_day(store_path: str, date: datetime, aggregate: LogAggregate) -> None:
+    # Must be called before LogAggregate.calculate_stats, which rounds sums
+    date_key = _date_key(date)
+    with closing(_connect(store_path)) as connection, connection:
+        connection.execute(
+            'DELETE FROM request_stats WHERE date = ?', (date_key,),
+        )
+        connection.execute(
+            'INSERT OR REPLACE INTO days VALUES (?, ?, ?, ?, ?)',
+            (
+                date_key,
+                aggregate.total_lines,
+                aggregate.failed_count,
+                aggregate.total_count,
+                aggregate.total_duration,
+            ),
+        )
+        connection.executemany(
+            'INSERT INTO request_stats VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (
+                (
+                    date_key,
+                    request_stat.url,
+                    request_stat.count,
+                    request_stat.time_sum,
+                    request_stat.time_max,
+                    request_stat.times.to_bytes(),
+                    request_stat.raw_urls and request_stat.raw_urls.to_bytes(),
+                )
+                for request_stat in aggregate.get_request_stats()
+            ),
+        )
+
+
+def get_missing_days(
+        store_path: str,
+        start: datetime,
+        end: datetime,
+) -> list[datetime]:
+    with closing(_connect(store_path)) as connection:
+        stored_days = {
+            date for date, in connection.execute(
+                'SELECT date FROM days WHERE date BETWEEN ? AND ?',
+                (_date_key(start), _date_key(end)),
+            )
+        }
+
+    days = (start + timedelta(days=i) for i in range((end - start).days + 1))
+    return [day for day in days if _date_key(day) not in stored_days]
+
+
+def load_range(
+        store_path: str,
+        start: datetime,
+        end: datetime,
+        make_aggregate: AggregateFactory = LogAggregate,
+) -> LogAggregate:
+    aggregate = make_aggregate()
+    date_range = (_date_key(start), _date_key(end))
+    with closing(_connect(store_path)) as connection:
+        for day in connection.execute(
+            'SELECT total_lines, failed_count, total_count, total_duration '
+            'FROM days WHERE date BETWEEN ? AND ?',
+            date_range,
+        ):
+            aggregate.merge(LogAggregate(
+                total_lines=day[0],
+                failed_count=day[1],
+                total_count=day[2],
+                total_duration=day[3],
+            ))
+
+        # Days are merged as partial aggregates, so top-k summaries account
+        # for URLs dropped from other days
+        rows = connection.execute(
+            'SELECT date, url, count, time_sum, time_max, times, raw_urls '
+            'FROM request_stats WHERE date BETWEEN ? AND ? ORDER BY date',
+            date_range,
+        )
+        for _, day_rows in groupby(rows, key=itemgetter(0)):
+            day_aggregate = make_aggregate()
+            for _, url, count, time_sum, time_max, times, raw_urls in day_rows:
+                day_aggregate.merge_request_stat(RequestStat(
+                    url=url,
+                    count=count,
+                    time_sum=time_sum,
+                    time_max=time_max,
+                    times=QuantileSketch.from_bytes(times),
+                    raw_urls=(
+                        None if raw_urls is None
+                        else DistinctCounter.from_bytes(raw_urls)
+                    ),
+                ))
+            aggregate.merge(day_aggregate)
+
+    return aggregate
@@ -0,0 +1,119 @@
+import os
+import unittest
+from functools import partial
+from unittest import mock
+
+from cache import aggregate_cached, build_cache, load_cache
+from columnar import ColumnarLogAggregate, np
+from config import Config
+from log_parser import File
+from metrics import Metrics
+from parallel import aggregate_log_file
+from stats import LogAggregate
+from testing import LOG_LINE, TmpDirTestCase
+from urls import UrlNormalizer
+
+
+class TestLogCache(TmpDirTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        cache_dir = os.path.join(self.tmp_dir, 'cache')
+        self.config = Config(
+            LOG_DIR=os.path.join(self.tmp_dir, 'log'),
+            CACHE_DIR=cache_dir,
+        )
+        self.log_file = File.from_file_name('nginx-access-ui.log-20170630')
+        self.log_path = os.path.join(self.config.LOG_DIR, self.log_file.name)
+        self.cache_path = os.path.join(
+            cache_dir, f'{self.log_file.name}.cache',
+        )
+        os.makedirs(self.config.LOG_DIR)
+        with open(self.log_path, 'w') as log_file:
+            log_file.writelines(
+                LOG_LINE.format(url=f'/api/{i % 7}/{i % 3}', duration=i / 1000)
+                if i % 10 else 'broken line\n'
+                for i in range(3000)
+            )
+
+    def _assert_same_stats(
+            self,
+            aggregate: LogAggregate,
+            expected: LogAggregate,
+    ) -> None:
+        self.assertEqual(aggregate.total_lines, expected.total_lines)
+        self.assertEqual(aggregate.failed_count, expected.failed_count)
+        # Durations are float32 in the cache, rounded stats may differ
+        # in the last digit
+        expected_stats = {s.url: s for s in expected.calculate_stats()}
+        stats = aggregate.calculate_stats()
+        self.assertEqual(len(stats), len(expected_stats))
+        for stat in stats:
+            expected_stat = expected_stats[stat.url]
+            self.assertEqual(stat.count, expected_stat.count)
+            self.assertEqual(stat.raw_url_count, expected_stat.raw_url_count)
+            for name in ('time_sum', 'time_max', 'time_med', 'time_p99'):
+                self.assertAlmostEqual(
+                    getattr(stat, name),
+                    getattr(expected_stat, name),
+                    delta=.0011,
+                )
+
+    def test_aggregate_cached(self) -> None:
+        metrics = Metrics()
+        aggregate = aggregate_cached(
+            self.config, self.log_file, LogAggregate, metrics,
+        )
+        self.assertIn('cache', metrics.stages)
+        self._assert_same_stats(aggregate, aggregate_log_file(self.log_path))
+
+        # Next run is aggregated from the cache with another normalization
+        metrics = Metrics()
+        make_aggregate = partial(LogAggregate, normalizer=UrlNormalizer())
+        aggregate = aggregate_cached(
+            self.config, self.log_file, make_aggregate, metrics,
+        )
+        self.assertNotIn('cache', metrics.stages)
+        self._assert_same_stats(
+            aggregate, aggregate_log_file(self.log_path, 1, make_aggregate),
+        )
+
+        # Requests are read in blocks, the last one is incomplete
+        with mock.patch('cache.AGGREGATE_BLOCK', 1000):
+            aggregate = aggregate_cached(
+                self.config, self.log_file, LogAggregate,
+            )
+        self._assert_same_stats(aggregate, aggregate_log_file(self.log_path))
+
+    @unittest.skipIf(np is None, 'numpy is not installed')
+    def test_columnar(self) -> None:
+        build_cache(self.log_path, self.cache_path)
+        for normalizer in (None, UrlNormalizer()):
+            make_aggregate = partial(
+                ColumnarLogAggregate, normalizer=normalizer,
+            )
+            self._assert_same_stats(
+                aggregate_cached(self.config, self.log_file, make_aggregate),
+                aggregate_log_file(self.log_path, 1, make_aggregate),
+            )
+
+    def test_invalidation(self) -> None:
+        build_cache(self.log_path, self.cache_path)
+        cache = load_cache(self.log_path, self.cache_path)
+        assert cache is not None
+        self.assertEqual(cache.total_lines, 3000)
+        self.assertEqual(len(cache.ids), 2700)
+        cache.close()
+
+        with open(self.log_path, 'a') as log_file:
+            log_file.write('broken line\n')
+        self.assertIsNone(load_cache(self.log_path, self.cache_path))
+
+        with open(self.log_path, 'w'):
+            pass
+        build_cache(self.log_path, self.cache_path)
+        aggregate = aggregate_cached(self.config, self.log_file, LogAggregate)
+        self.assertEqual(aggregate.total_lines, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
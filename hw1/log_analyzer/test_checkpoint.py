@@ -0,0 +1,95 @@
+import gzip
+import os
+import unittest
+from datetime import datetime
+from typing import Callable
+
+from checkpoint import aggregate_incrementally, load_checkpoint
+from config import Config
+from log_parser import File
+from parallel import aggregate_log_file
+from stats import LogAggregate
+from testing import LOG_LINE, TmpDirTestCase
+
+
+class TestCheckpoint(TmpDirTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.config = Config(
+            LOG_DIR=os.path.join(self.tmp_dir, 'log'),
+            REPORT_DIR=os.path.join(self.tmp_dir, 'reports'),
+            CHECKPOINT_DIR=os.path.join(self.tmp_dir, 'checkpoints'),
+            CHECKPOINT_INTERVAL=256,
+        )
+        os.makedirs(self.config.LOG_DIR)
+        self.lines = [
+            LOG_LINE.format(url=f'/api/{i % 5}', duration=i % 9 / 10)
+            for i in range(300)
+        ]
+
+    def _write(self, log_file: File, content: str, mode: str = 'w') -> str:
+        path = os.path.join(self.config.LOG_DIR, log_file.name)
+        open_func: Callable = open
+        if log_file.name.endswith('.gz'):
+            open_func = gzip.open
+        with open_func(path, mode + 't', encoding='utf-8') as f:
+            f.write(content)
+
+        return path
+
+    def _resume(self, log_file: File) -> LogAggregate:
+        return aggregate_incrementally(
+            self.config,
+            log_file,
+            LogAggregate,
+            load_checkpoint(self.config, log_file),
+        )
+
+    def _assert_same(self, aggregate: LogAggregate, path: str) -> None:
+        expected = aggregate_log_file(path)
+        self.assertEqual(aggregate.total_lines, expected.total_lines)
+        self.assertEqual(
+            {s.url: s.count for s in aggregate.calculate_stats()},
+            {s.url: s.count for s in expected.calculate_stats()},
+        )
+
+    def test_appended_lines(self) -> None:
+        log_file = File('nginx-access-ui.log-20170630', datetime(2017, 6, 30))
+        self._write(log_file, ''.join(self.lines[:100]))
+        self.assertEqual(self._resume(log_file).total_lines, 100)
+
+        # Unfinished last line is left for the next run
+        self._write(log_file, ''.join(self.lines[100:200]) + '1.2.3', 'a')
+        self.assertEqual(self._resume(log_file).total_lines, 200)
+        checkpoint = load_checkpoint(self.config, log_file)
+        assert checkpoint is not None
+        self.assertEqual(checkpoint.offset, len(''.join(self.lines[:200])))
+
+        path = self._write(log_file, self.lines[200][5:], 'a')
+        self._write(log_file, ''.join(self.lines[201:]), 'a')
+        self._assert_same(self._resume(log_file), path)
+
+    def test_gzip_resume(self) -> None:
+        log_file = File(
+            'nginx-access-ui.log-20170630.gz', datetime(2017, 6, 30),
+        )
+        self._write(log_file, ''.join(self.lines[:150]))
+        self._resume(log_file)
+
+        path = self._write(log_file, ''.join(self.lines[150:]), 'a')
+        self._assert_same(self._resume(log_file), path)
+
+    def test_stale_checkpoint(self) -> None:
+        log_file = File('nginx-access-ui.log-20170630', datetime(2017, 6, 30))
+        path = self._write(log_file, ''.join(self.lines))
+        self._resume(log_file)
+        self.assertIsNotNone(load_checkpoint(self.config, log_file))
+
+        # Truncated (or rotated) file is processed from scratch
+        self._write(log_file, ''.join(self.lines[:10]))
+        self.assertIsNone(load_checkpoint(self.config, log_file))
+        self._assert_same(self._resume(log_file), path)
+
+
+if __name__ == '__main__':
+    unittest.main()
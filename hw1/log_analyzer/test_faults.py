@@ -0,0 +1,76 @@
+import unittest
+
+from faults import FaultMonitor, FaultRateExceeded
+from log_parser import RequestLog
+
+
+class TestFaultMonitor(unittest.TestCase):
+    @staticmethod
+    def _add(monitor: FaultMonitor, failed: int, succeeded: int) -> None:
+        request_logs = (
+            [RequestLog(success=False)] * failed
+            + [RequestLog()] * succeeded
+        )
+        monitor.add(
+            [f'line {i}'.encode() for i in range(len(request_logs))],
+            request_logs,
+        )
+
+    def test_warmup(self) -> None:
+        monitor = FaultMonitor(max_fault_rate=.5, warmup=100)
+        self._add(monitor, 99, 0)
+        monitor.check()
+
+        self._add(monitor, 1, 0)
+        with self.assertRaises(FaultRateExceeded):
+            monitor.check()
+
+    def test_confidence(self) -> None:
+        # Slightly above the limit on a small sample is not enough
+        monitor = FaultMonitor(max_fault_rate=.5, warmup=10)
+        self._add(monitor, 60, 40)
+        self.assertGreater(monitor.fault_rate, .5)
+        monitor.check()
+
+        self._add(monitor, 6000, 4000)
+        with self.assertRaises(FaultRateExceeded):
+            monitor.check()
+
+    def test_samples(self) -> None:
+        monitor = FaultMonitor(first_line=11)
+        self._add(monitor, 0, 3)
+        self._add(monitor, 2, 1)
+        other = FaultMonitor(first_line=1)
+        self._add(other, 4, 0)
+        monitor.merge(other)
+
+        self.assertEqual(monitor.lines, 10)
+        self.assertEqual(monitor.failed, 6)
+        self.assertEqual(
+            monitor.samples,
+            [
+                ('', 1, b'line 0'), ('', 2, b'line 1'), ('', 3, b'line 2'),
+                ('', 4, b'line 3'), ('', 14, b'line 0'),
+            ],
+        )
+        self.assertIn('line 14', monitor.describe())
+
+    def test_sampled(self) -> None:
+        # Only lines 2, 5 and 8 of 10 are parsed, failed ones keep their
+        # numbers among all lines
+        monitor = FaultMonitor(first_line=11)
+        lines = [f'line {i}'.encode() for i in range(10)]
+        failed = RequestLog(success=False)
+        monitor.add(lines, [failed, RequestLog(), failed], [2, 5, 8])
+        monitor.add(lines[:3], [failed], [1])
+
+        self.assertEqual(monitor.lines, 4)
+        self.assertEqual(monitor.failed, 3)
+        self.assertEqual(
+            monitor.samples,
+            [('', 13, b'line 2'), ('', 19, b'line 8'), ('', 22, b'line 1')],
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
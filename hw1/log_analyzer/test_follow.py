@@ -0,0 +1,103 @@
+import json
+import os
+import unittest
+
+from config import Config
+from follow import (FOLLOW_LOG_NAME, LogFollower, RollingAggregate, follow,
+                    save_snapshot)
+from stats import LogAggregate
+from testing import LOG_LINE, TmpDirTestCase
+
+
+class TestFollow(TmpDirTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.log_dir = self.tmp_dir
+        self.log_path = os.path.join(self.log_dir, FOLLOW_LOG_NAME)
+
+    def _append(self, content: str, mode: str = 'a') -> None:
+        with open(self.log_path, mode) as log_file:
+            log_file.write(content)
+
+    def test_follower(self) -> None:
+        self._append('old line\n')
+        follower = LogFollower(self.log_path)
+        self.addCleanup(follower.close)
+        self.assertEqual(list(follower.read_chunks()), [])
+
+        self._append('line 1\nline 2\npartial')
+        self.assertEqual(
+            b''.join(follower.read_chunks()), b'line 1\nline 2\n',
+        )
+        self._append(' line\n')
+        self.assertEqual(b''.join(follower.read_chunks()), b'partial line\n')
+
+        # Rotation: the rest of the old file, then the new one from start
+        self._append('line 3\n')
+        os.rename(self.log_path, f'{self.log_path}-20170630')
+        self.assertEqual(b''.join(follower.read_chunks()), b'line 3\n')
+        self._append('line 4\n')
+        self.assertEqual(b''.join(follower.read_chunks()), b'line 4\n')
+
+        # Truncation
+        self._append('l5\n', mode='w')
+        self.assertEqual(b''.join(follower.read_chunks()), b'l5\n')
+
+    def test_rolling_aggregate(self) -> None:
+        rolling = RollingAggregate(LogAggregate, [120, 600], bucket_size=60)
+        for minute in range(20):
+            rolling.add_chunk(
+                LOG_LINE.format(url='/api/1', duration=1).encode(),
+                minute * 60 + 30,
+            )
+
+        now = 19 * 60 + 40
+        self.assertEqual(len(rolling.buckets), 11)
+        self.assertEqual(rolling.window(120, now).total_count, 3)
+        self.assertEqual(rolling.window(600, now).total_count, 11)
+        # Windows don't change buckets
+        self.assertEqual(rolling.window(600, now).total_count, 11)
+
+    def test_follow(self) -> None:
+        config = Config(
+            LOG_DIR=self.log_dir,
+            REPORT_DIR=os.path.join(self.log_dir, 'reports'),
+            FOLLOW_INTERVAL=0,
+            FOLLOW_WINDOWS=[300, 3600],
+        )
+        self._append('')
+        iterations = iter(range(3))
+
+        def should_stop() -> bool:
+            iteration = next(iterations, None)
+            if iteration is None:
+                return True
+            self._append(
+                LOG_LINE.format(url=f'/api/{iteration}', duration=.5) * 2,
+            )
+            return False
+
+        follow(config, LogAggregate, should_stop, poll_interval=0)
+
+        snapshot_path = os.path.join(config.REPORT_DIR, 'report-live.json')
+        with open(snapshot_path) as snapshot_file:
+            snapshot = json.load(snapshot_file)
+        self.assertEqual(set(snapshot['windows']), {'5m', '1h'})
+        window = snapshot['windows']['5m']
+        self.assertEqual(window['total_count'], 6)
+        self.assertEqual(
+            sorted(request['url'] for request in window['requests']),
+            ['/api/0', '/api/1', '/api/2'],
+        )
+        self.assertEqual(window['requests'][0]['time_sum'], 1.)
+
+        rolling = RollingAggregate(LogAggregate, [60])
+        save_snapshot(config, rolling, 0)
+        with open(snapshot_path) as snapshot_file:
+            self.assertEqual(
+                json.load(snapshot_file)['windows']['1m']['requests'], [],
+            )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,11 +1,27 @@
+import gzip
+import json
+import os
+import random
+import re
 import unittest
+from functools import partial
 from typing import Generator
 
-from log_analyzer import RequestStat, process_request_logs
-from log_parser import Request, RequestLog
+from columnar import ColumnarLogAggregate, np
+from config import Config
+from faults import FaultMonitor, FaultRateExceeded
+from log_analyzer import (RequestStat, analyze_log_file, backfill,
+                          build_range_report, get_aggregate_factory,
+                          process_request_logs, save_result)
+from log_parser import Request, RequestLog, get_source_files, read_log_lines
+from metrics import Metrics
+from parallel import (aggregate_log_file, aggregate_request_logs,
+                      aggregate_sources)
+from stats import LogAggregate, TopKLogAggregate
+from testing import LOG_LINE, TmpDirTestCase
 
 
-class TestLogAnalyzer(unittest.TestCase):
+class TestLogAnalyzer(TmpDirTestCase):
     @staticmethod
     def _log_line_generator(
         logs: list[tuple[str, float, bool]],
@@ -81,6 +97,418 @@ class TestLogAnalyzer(unittest.TestCase):
         self.assertEqual(len(request_stats), 1)
         self.assertAlmostEqual(fault_rate, 0.5)
 
+    def test_top_k(self) -> None:
+        rnd = random.Random(1)
+        logs = [(f'/heavy/{i % 5}', 1., True) for i in range(500)]
+        logs += [(f'/crawl/{i}', rnd.random() / 10, True) for i in range(5000)]
+        rnd.shuffle(logs)
+
+        exact = {
+            s.url: s for s in aggregate_request_logs(
+                self._log_line_generator(logs),
+            ).calculate_stats()
+        }
+        partials = [
+            aggregate_request_logs(
+                self._log_line_generator(logs[i::2]),
+                lambda: TopKLogAggregate(capacity=50),
+            )
+            for i in range(2)
+        ]
+        partials[0].merge(partials[1])
+        self.assertLessEqual(len(partials[0].request_stats), 50)
+
+        stats = sorted(
+            partials[0].calculate_stats(),
+            key=lambda s: s.time_sum,
+            reverse=True,
+        )
+        self.assertSetEqual(
+            {s.url for s in stats[:5]},
+            {f'/heavy/{i}' for i in range(5)},
+        )
+        for stat in stats:
+            assert stat.count_error is not None
+            assert stat.time_sum_error is not None
+            expected = exact[stat.url]
+            self.assertGreaterEqual(stat.count, expected.count)
+            self.assertLessEqual(stat.count - stat.count_error, expected.count)
+            self.assertGreaterEqual(stat.time_sum + .001, expected.time_sum)
+            self.assertLessEqual(
+                stat.time_sum - stat.time_sum_error,
+                expected.time_sum + .002,
+            )
+            self.assertIn('time_sum_error', stat.to_dict())
+
+        # /x is dropped from the full partial, the merged stats are bounded
+        # by the errors
+        dropped = aggregate_request_logs(
+            self._log_line_generator(
+                [('/x', 1., True)] * 5 + [('/y', 1., True)] * 100
+                + [('/z', 1., True)],
+            ),
+            lambda: TopKLogAggregate(capacity=2),
+        )
+        self.assertNotIn('/x', dropped.request_stats)
+        merged = aggregate_request_logs(
+            self._log_line_generator([('/x', 1., True)] * 10),
+            lambda: TopKLogAggregate(capacity=3),
+        )
+        merged.merge(dropped)
+        for url, count in (('/x', 15), ('/y', 100), ('/z', 1)):
+            stat = merged.request_stats[url]
+            self.assertLessEqual(stat.count - (stat.count_error or 0), count)
+            self.assertLessEqual(count, stat.count)
+            self.assertLessEqual(
+                stat.time_sum - (stat.time_sum_error or 0), count,
+            )
+            self.assertLessEqual(count, stat.time_sum)
+
+    @unittest.skipIf(np is None, 'numpy is not installed')
+    def test_columnar(self) -> None:
+        rnd = random.Random(2)
+        logs = [
+            (f'/api/{rnd.randrange(40)}', round(rnd.expovariate(3), 3), True)
+            for _ in range(3000)
+        ] + [('/broken', 0., False)] * 10
+
+        exact = aggregate_request_logs(
+            self._log_line_generator(logs),
+            lambda: LogAggregate(exact_limit=len(logs)),
+        )
+
+        # Partials of consecutive lines keep the order of summation
+        columnar = ColumnarLogAggregate()
+        for i in range(0, len(logs), 1000):
+            columnar.merge(aggregate_request_logs(
+                self._log_line_generator(logs[i:i + 1000]),
+                ColumnarLogAggregate,
+            ))
+        self.assertAlmostEqual(columnar.fault_rate, exact.fault_rate)
+        self.assertListEqual(
+            sorted(
+                (s.to_dict() for s in columnar.calculate_stats()),
+                key=lambda s: s['url'],
+            ),
+            sorted(
+                (s.to_dict() for s in exact.calculate_stats()),
+                key=lambda s: s['url'],
+            ),
+        )
+
+    def _write_log(self, file_name: str, lines: int) -> str:
+        content = ''.join(
+            LOG_LINE.format(url=f'/api/{i % 7}', duration=i % 13 / 10)
+            if i % 11 else 'broken line\n'
+            for i in range(lines)
+        )
+        path = os.path.join(self.tmp_dir, file_name)
+        open_func = gzip.open if file_name.endswith('.gz') else open
+        with open_func(path, 'wt', encoding='utf-8') as log_file:
+            log_file.write(content)
+
+        return path
+
+    def _assert_parallel_matches(self, path: str) -> None:
+        sequential = aggregate_log_file(path, workers=1)
+        parallel = aggregate_log_file(path, workers=3)
+
+        self.assertEqual(parallel.total_lines, sequential.total_lines)
+        self.assertAlmostEqual(parallel.fault_rate, sequential.fault_rate)
+        expected_stats = {s.url: s for s in sequential.calculate_stats()}
+        stats = parallel.calculate_stats()
+        self.assertEqual(len(stats), len(expected_stats))
+        for stat in stats:
+            self._cmp_stats(expected_stats[stat.url], stat)
+
+    def test_parallel_plain(self) -> None:
+        self._assert_parallel_matches(
+            self._write_log('nginx-access-ui.log-20170630', 1000),
+        )
+
+    def test_parallel_gzip(self) -> None:
+        self._assert_parallel_matches(
+            self._write_log('nginx-access-ui.log-20170630.gz', 1000),
+        )
+
+    def test_metrics(self) -> None:
+        path = self._write_log('nginx-access-ui.log-20170630', 1000)
+        for workers, stages in (
+                (1, {'read', 'parse', 'aggregate'}),
+                (2, {'process'}),
+        ):
+            metrics = Metrics()
+            aggregate_log_file(path, workers, metrics=metrics)
+            self.assertEqual(metrics.counters['lines'], 1000)
+            self.assertEqual(
+                metrics.counters['bytes'], os.path.getsize(path),
+            )
+            self.assertLessEqual(stages, set(metrics.stages))
+            self.assertGreater(metrics.lines_per_sec or 0, 0)
+            self.assertIn('lines_per_sec', metrics.to_dict())
+
+    def test_sampling(self) -> None:
+        rnd = random.Random(3)
+        path = os.path.join(self.tmp_dir, 'nginx-access-ui.log-20170630')
+        with open(path, 'w', encoding='utf-8') as log_file:
+            log_file.writelines(
+                LOG_LINE.format(
+                    url=f'/api/{int(rnd.paretovariate(1)) % 50}',
+                    duration=round(rnd.expovariate(3), 3),
+                ).replace('9752795', str(i))
+                for i in range(50_000)
+            )
+
+        exact = {s.url: s for s in aggregate_log_file(path).calculate_stats()}
+        by_line = partial(LogAggregate, sample_rate=10)
+        aggregate = aggregate_log_file(path, 1, by_line)
+        self.assertLess(aggregate.total_lines, 6000)
+        stats = aggregate.calculate_stats()
+        # Normal approximation holds for URLs with enough sampled lines
+        for stat in (s for s in stats if s.count >= 1000):
+            assert stat.count_ci is not None and stat.time_sum_ci is not None
+            expected = exact[stat.url]
+            self.assertLessEqual(
+                abs(stat.count - expected.count), 2 * stat.count_ci,
+            )
+            self.assertLessEqual(
+                abs(stat.time_sum - expected.time_sum),
+                2 * stat.time_sum_ci + .001,
+            )
+        self.assertAlmostEqual(sum(s.count_perc for s in stats), 100, 1)
+
+        # Samples are the same in every run and in worker processes
+        request_stats, _ = process_request_logs(
+            read_log_lines(path, sample_rate=10), sample_rate=10,
+        )
+        for other_stats in (
+                request_stats,
+                aggregate_log_file(path, 3, by_line).calculate_stats(),
+        ):
+            self.assertListEqual(
+                sorted((s.url, s.count, s.count_ci) for s in other_stats),
+                sorted((s.url, s.count, s.count_ci) for s in stats),
+            )
+
+        # URLs sampled by URL are complete
+        by_url = partial(LogAggregate, sample_rate=10, sample_by='url')
+        stats = aggregate_log_file(path, 1, by_url).calculate_stats()
+        self.assertTrue(0 < len(stats) < len(exact))
+        for stat in stats:
+            self.assertIsNone(stat.count_ci)
+            self.assertEqual(stat.count, exact[stat.url].count)
+            self.assertAlmostEqual(stat.time_sum, exact[stat.url].time_sum)
+
+        for sample_rate in (0, -10):
+            with self.assertRaises(ValueError):
+                get_aggregate_factory(Config(SAMPLE_RATE=sample_rate))
+
+    def test_fault_rate_abort(self) -> None:
+        lines = [
+            LOG_LINE.format(url='/api/1', duration=.1) if i % 10 == 0
+            else f'broken line {i}\n'
+            for i in range(300_000)
+        ]
+        for file_name, workers in (
+                ('nginx-access-ui.log-20170630', 1),
+                ('nginx-access-ui.log-20170630', 3),
+                ('nginx-access-ui.log-20170630.gz', 3),
+        ):
+            path = os.path.join(self.tmp_dir, file_name)
+            open_func = gzip.open if file_name.endswith('.gz') else open
+            with open_func(path, 'wt', encoding='utf-8') as log_file:
+                log_file.writelines(lines)
+
+            monitor = FaultMonitor(max_fault_rate=.5, warmup=1000)
+            with self.assertRaises(FaultRateExceeded) as raised:
+                aggregate_log_file(path, workers, monitor=monitor)
+
+            aborted = raised.exception.monitor
+            self.assertGreater(aborted.fault_rate, .5)
+            self.assertEqual(len(aborted.samples), 5)
+            for _, line_number, line in aborted.samples:
+                self.assertEqual(line + b'\n', lines[line_number - 1].encode())
+            if workers == 1:
+                self.assertLess(aborted.lines, len(lines))
+
+            # Sampled lines are numbered by their place in the log
+            by_line = partial(LogAggregate, sample_rate=10)
+            monitor = FaultMonitor(max_fault_rate=.5, warmup=1000)
+            with self.assertRaises(FaultRateExceeded) as raised:
+                aggregate_log_file(path, workers, by_line, monitor=monitor)
+            for _, line_number, line in raised.exception.monitor.samples:
+                self.assertEqual(line + b'\n', lines[line_number - 1].encode())
+
+        path = self._write_log('nginx-access-ui.log-20170701', 10_000)
+        for workers in (1, 3):
+            monitor = FaultMonitor(max_fault_rate=.2, warmup=1000)
+            aggregate = aggregate_log_file(path, workers, monitor=monitor)
+            self.assertEqual(aggregate.total_lines, 10_000)
+
+    def test_fault_rate_merged(self) -> None:
+        # Broken tail of a log is judged together with the rest of it
+        path = os.path.join(self.tmp_dir, 'nginx-access-ui.log-20170630')
+        with open(path, 'w', encoding='utf-8') as log_file:
+            log_file.writelines(
+                LOG_LINE.format(url='/api/1', duration=.1)
+                for _ in range(30_000)
+            )
+            log_file.writelines(f'{i} {"x" * 150}\n' for i in range(10_000))
+
+        for workers in (1, 4):
+            monitor = FaultMonitor(max_fault_rate=.5, warmup=1000)
+            aggregate = aggregate_log_file(path, workers, monitor=monitor)
+            self.assertEqual(aggregate.total_lines, 40_000)
+            self.assertEqual(monitor.failed, 10_000)
+            self.assertEqual(monitor.samples[0][1], 30_001)
+
+        broken = os.path.join(self.tmp_dir, 'broken.log')
+        with open(broken, 'w', encoding='utf-8') as log_file:
+            log_file.writelines(f'{i}\n' for i in range(5_000))
+        monitor = FaultMonitor(max_fault_rate=.5, warmup=1000)
+        aggregate, source_counts = aggregate_sources(
+            [path, broken], 2, monitor=monitor,
+        )
+        self.assertEqual(aggregate.total_lines, 45_000)
+        self.assertEqual(source_counts[broken], (5_000, 5_000))
+        self.assertEqual(monitor.samples[0], (broken, 1, b'0'))
+        self.assertIn(f'{broken} line 1: ', monitor.describe())
+
+    def test_sources(self) -> None:
+        sources = []
+        for host, name, lines in (
+                ('host1', 'nginx-access-ui.log-20170630', 1000),
+                ('host2', 'nginx-access-ui.log-20170630.gz', 500),
+                ('host3', 'nginx-access-ui.log-20170630', 0),
+        ):
+            os.makedirs(os.path.join(self.tmp_dir, host))
+            sources.append(os.path.join(self.tmp_dir, host, name))
+            os.rename(self._write_log(name, lines), sources[-1])
+
+        log_file, paths = get_source_files(
+            [os.path.join(self.tmp_dir, 'host*', 'nginx-*')],
+        )
+        self.assertListEqual(paths, sources)
+        self.assertEqual(log_file.date.strftime('%Y%m%d'), '20170630')
+
+        aggregate, source_counts = aggregate_sources(paths, 2)
+        self.assertEqual(aggregate.total_lines, 1500)
+        self.assertDictEqual(
+            source_counts,
+            {paths[0]: (1000, 91), paths[1]: (500, 46), paths[2]: (0, 0)},
+        )
+        expected = aggregate_log_file(paths[0])
+        expected.merge(aggregate_log_file(paths[1]))
+        self.assertListEqual(
+            sorted((s.url, s.count) for s in aggregate.calculate_stats()),
+            sorted((s.url, s.count) for s in expected.calculate_stats()),
+        )
+
+        config = Config(REPORT_DIR=os.path.join(self.tmp_dir, 'reports'))
+        with self.assertLogs('log_analyzer') as logs:
+            analyze_log_file(config, log_file, sources=paths)
+        self.assertIn(
+            f'Source {paths[1]}: 500 lines, 46 failed', logs.output[1],
+        )
+        self.assertListEqual(
+            os.listdir(config.REPORT_DIR), ['report-20170630.html'],
+        )
+
+        with self.assertRaises(ValueError):
+            get_source_files([paths[0], paths[0] + '1'])
+
+    def test_backfill(self) -> None:
+        log_dir = os.path.join(self.tmp_dir, 'log')
+        config = Config(
+            LOG_DIR=log_dir,
+            REPORT_DIR=os.path.join(self.tmp_dir, 'reports'),
+            BACKFILL_WORKERS=2,
+        )
+        os.makedirs(log_dir)
+        os.makedirs(config.REPORT_DIR)
+        for name in (
+                'nginx-access-ui.log-20170601',
+                'nginx-access-ui.log-20170602.gz',
+                'nginx-access-ui.log-20170603',
+        ):
+            os.rename(
+                self._write_log(name, 100),
+                os.path.join(log_dir, name),
+            )
+        for name, content in (
+                ('nginx-access-ui.log-20170604', ''),
+                ('nginx-access-ui.log-20170605', 'broken line\n'),
+                ('../reports/report-20170603.html', ''),
+        ):
+            with open(os.path.join(log_dir, name), 'w') as f:
+                f.write(content)
+
+        backfill(config)
+
+        self.assertListEqual(
+            sorted(os.listdir(config.REPORT_DIR)),
+            [
+                'report-20170601.html', 'report-20170602.html',
+                'report-20170603.html', 'report-20170604.html',
+            ],
+        )
+        report_path = os.path.join(config.REPORT_DIR, 'report-20170601.html')
+        with open(report_path) as f:
+            self.assertIn('/api/1', f.read())
+
+    def test_range_report_numpy(self) -> None:
+        config = Config(
+            REPORT_DIR=os.path.join(self.tmp_dir, 'reports'),
+            STORE_PATH=os.path.join(self.tmp_dir, 'store.sqlite'),
+            AGGREGATOR='numpy',
+        )
+        with self.assertRaises(ValueError):
+            build_range_report(config, '20170601:20170630')
+        self.assertFalse(os.path.exists(config.REPORT_DIR))
+
+    def test_paged_report(self) -> None:
+        config = Config(
+            REPORT_DIR=os.path.join(self.tmp_dir, 'reports'),
+            REPORT_PAGE_SIZE=4,
+        )
+        request_stats, _ = process_request_logs(self._log_line_generator(
+            [(f'/api/{i}', i / 10, True) for i in range(10)],
+        ))
+        data_dir = os.path.join(config.REPORT_DIR, 'report-20170630.data')
+        os.makedirs(data_dir)
+        with open(os.path.join(data_dir, 'chunk-00009.js'), 'w'):
+            pass
+
+        save_result(config, request_stats, 'report-20170630.html')
+
+        report_path = os.path.join(config.REPORT_DIR, 'report-20170630.html')
+        with open(report_path) as report_file:
+            report = report_file.read()
+        index_json = re.search(r'var index = (.*);', report)
+        assert index_json is not None
+        index = json.loads(index_json.group(1))
+        self.assertEqual(index['rows'], 10)
+        self.assertEqual(index['pages'], 3)
+        self.assertEqual(index['columns'][0], 'url')
+        self.assertEqual(index['data'], 'report-20170630.data')
+
+        # Stale chunks of the previous report are removed
+        self.assertListEqual(
+            sorted(os.listdir(data_dir)),
+            ['chunk-00000.js', 'chunk-00001.js', 'chunk-00002.js'],
+        )
+        rows = []
+        for number, name in enumerate(sorted(os.listdir(data_dir))):
+            with open(os.path.join(data_dir, name)) as chunk_file:
+                chunk = chunk_file.read()
+            prefix = f'reportChunk({number}, '
+            self.assertTrue(chunk.startswith(prefix))
+            rows.extend(json.loads(chunk[len(prefix):-3]))
+        self.assertListEqual(
+            [row['url'] for row in rows],
+            [f'/api/{i}' for i in reversed(range(10))],
+        )
+
 
 if __name__ == '__main__':
     unittest.main()
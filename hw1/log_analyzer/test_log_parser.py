@@ -1,11 +1,22 @@
+import gzip
+import os
 import re
+import tempfile
 import unittest
 from datetime import datetime
 
-from log_parser import File, log_format_regexp, parse_log_line
+from log_parser import (File, find_gzip_tool, log_format_regexp,
+                        parse_log_line, parse_log_line_fast, read_gzip_blocks,
+                        read_log_chunks, read_log_lines, report_format_regexp,
+                        sample_lines, split_chunk, split_log_file)
+from testing import LOG_LINE, TmpDirTestCase
 
+CAMPAIGN_LINE = LOG_LINE.format(
+    url='/api/1/campaigns/?id=7789711', duration=.163,
+).rstrip('\n')
 
-class TestLogParser(unittest.TestCase):
+
+class TestLogParser(TmpDirTestCase):
     def _assert_datetimes(
             self,
             file_name: str,
@@ -28,6 +39,14 @@ class TestLogParser(unittest.TestCase):
             re.match(log_format_regexp, 'some-other-app.log-12345678.gz'),
         )
 
+    def test_report_regexp(self) -> None:
+        self.assertTrue(
+            re.match(report_format_regexp, 'report-20170630.html'),
+        )
+        self.assertFalse(
+            re.match(report_format_regexp, 'report-20170601-20170630.html'),
+        )
+
     def test_file_creation(self) -> None:
         self._assert_datetimes(
             'nginx-access-ui.log-20211212',
@@ -43,11 +62,7 @@ class TestLogParser(unittest.TestCase):
         )
 
     def test_log_format(self) -> None:
-        request_log = parse_log_line(
-            '1.200.76.128 f032b48fb33e1e692  - [29/Jun/2017:03:50:24 +0300]'
-            '"GET /api/1/campaigns/?id=7789711 HTTP/1.1" 200 608 "-" "-" "-" '
-            '"1498697424-4102637017-4708-9752795" "-" 0.163'
-        )
+        request_log = parse_log_line(CAMPAIGN_LINE)
         self.assertEqual(
             request_log.request.name,
             '/api/1/campaigns/?id=7789711',
@@ -58,6 +73,126 @@ class TestLogParser(unittest.TestCase):
         with self.assertRaises(ValueError):
             parse_log_line('')
 
+    def test_fast_log_format(self) -> None:
+        for line in (
+                CAMPAIGN_LINE,
+                CAMPAIGN_LINE + '\n',
+                CAMPAIGN_LINE.replace(' ', '\t'),
+        ):
+            self.assertEqual(
+                parse_log_line_fast(line.encode('utf-8')),
+                parse_log_line(line),
+            )
+
+        # Malformed for the fast path, but still parsed by the regexp
+        line = CAMPAIGN_LINE.replace('0.163', 'time=0.163')
+        self.assertEqual(
+            parse_log_line_fast(line.encode('utf-8')),
+            parse_log_line(line),
+        )
+
+        for line in (
+                '', 'no request 0.1', '"GET /" 0.1', CAMPAIGN_LINE + ' -',
+        ):
+            with self.assertRaises(ValueError):
+                parse_log_line_fast(line.encode('utf-8'))
+
+        with self.assertRaises(ValueError):
+            parse_log_line_fast(CAMPAIGN_LINE.encode('utf-8') + b'\xff')
+
+    def test_split_log_file(self) -> None:
+        lines = [f'line {i}\n'.encode() * (i % 5 + 1) for i in range(100)]
+        with tempfile.NamedTemporaryFile(delete=False) as log_file:
+            log_file.write(b''.join(lines))
+        self.addCleanup(os.remove, log_file.name)
+
+        ranges = split_log_file(log_file.name, 4)
+        self.assertEqual(ranges[0][0], 0)
+        self.assertEqual(ranges[-1][1], os.path.getsize(log_file.name))
+        with open(log_file.name, 'rb') as f:
+            content = f.read()
+        for (_, end), (start, _) in zip(ranges, ranges[1:]):
+            self.assertEqual(end, start)
+            self.assertEqual(content[start - 1:start], b'\n')
+
+    def test_read_log_chunks(self) -> None:
+        content = b''.join(
+            f'line {i}'.encode() * (i % 7) + b'\n' for i in range(200)
+        ) + b'no newline'
+
+        for file_name in ('nginx-access-ui.log-1', 'nginx-access-ui.log-1.gz'):
+            path = os.path.join(self.tmp_dir, file_name)
+            open_func = gzip.open if file_name.endswith('.gz') else open
+            with open_func(path, 'wb') as log_file:
+                log_file.write(content)
+
+            for chunk_size in (1, 17, 1 << 20):
+                chunks = list(read_log_chunks(path, chunk_size=chunk_size))
+                self.assertEqual(b''.join(c for c, _ in chunks), content)
+                self.assertEqual(chunks[-1][1], len(content))
+                for chunk, _ in chunks[:-1]:
+                    self.assertTrue(chunk.endswith(b'\n'))
+                lines = [
+                    line for chunk, _ in chunks for line in split_chunk(chunk)
+                ]
+                self.assertEqual(lines, content.split(b'\n'))
+
+    def test_read_gzip_blocks(self) -> None:
+        content = b''.join(f'line {i}\n'.encode() for i in range(10_000))
+        path = os.path.join(self.tmp_dir, 'nginx-access-ui.log-1.gz')
+        with gzip.open(path, 'wb') as log_file:
+            log_file.write(content)
+        broken_path = os.path.join(self.tmp_dir, 'broken.gz')
+        with open(broken_path, 'wb') as log_file:
+            log_file.write(gzip.compress(content)[:1000])
+
+        for tool in {None, find_gzip_tool()}:
+            blocks = list(read_gzip_blocks(path, 1000, tool, depth=2))
+            self.assertEqual(b''.join(blocks), content)
+            self.assertTrue(all(len(block) == 1000 for block in blocks[:-1]))
+
+            # Reader stops early, decompressor must not hang on a full queue
+            blocks_iter = read_gzip_blocks(path, 10, tool, depth=1)
+            self.assertEqual(next(blocks_iter), content[:10])
+            blocks_iter.close()
+
+            with self.assertRaises((OSError, EOFError)):
+                list(read_gzip_blocks(broken_path, 1000, tool))
+
+    def test_sample_lines(self) -> None:
+        lines = [
+            CAMPAIGN_LINE.replace('7789711', str(i % 100))
+            .replace('4102637017', str(i)).encode()
+            for i in range(10_000)
+        ] + [b'broken line'] * 10
+
+        sampled = sample_lines(lines, 10)
+        self.assertEqual(sampled, sample_lines(lines, 10))
+        self.assertAlmostEqual(len(sampled) / len(lines), .1, delta=.02)
+        self.assertEqual(sample_lines(lines, 1), lines)
+
+        # Every line of a sampled URL is kept
+        sampled = sample_lines(lines, 10, 'url')
+        sampled_urls = {line.split(b'"')[1] for line in sampled}
+        self.assertEqual(len(sampled), len(sampled_urls) * 100)
+
+    def test_read_log_lines(self) -> None:
+        with tempfile.NamedTemporaryFile(delete=False) as log_file:
+            log_file.write(
+                f'{CAMPAIGN_LINE}\n\nbroken\n{CAMPAIGN_LINE}'.encode(),
+            )
+        self.addCleanup(os.remove, log_file.name)
+
+        request_logs = list(read_log_lines(log_file.name))
+        self.assertEqual(
+            [request_log.success for request_log in request_logs],
+            [True, False, False, True],
+        )
+        self.assertEqual(
+            request_logs[3].request.name,
+            '/api/1/campaigns/?id=7789711',
+        )
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,77 @@
+import os
+import time
+import unittest
+from datetime import datetime
+from unittest import mock
+
+from config import Config
+from log_parser import get_next_log_file, log_format_regexp
+from manifest import Manifest
+from testing import TmpDirTestCase
+
+
+class TestManifest(TmpDirTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.log_dir = os.path.join(self.tmp_dir, 'log')
+        self.manifest_path = os.path.join(self.tmp_dir, 'manifest.json')
+        self.config = Config(
+            LOG_DIR=self.log_dir,
+            REPORT_DIR=os.path.join(self.tmp_dir, 'reports'),
+            MANIFEST_PATH=self.manifest_path,
+        )
+        os.makedirs(self.log_dir)
+        for name in (
+                'nginx-access-ui.log-20170630.gz',
+                'nginx-access-ui.log-20170631',
+                'nginx-access-ui.log',
+                'README',
+        ):
+            self._touch(self.log_dir, name)
+
+    def _touch(self, directory: str, name: str) -> None:
+        with open(os.path.join(directory, name), 'w'):
+            pass
+
+        # Directory mtime is set back, so it isn't too recent to be trusted
+        mtime_ns = time.time_ns() - 10_000_000_000
+        os.utime(directory, ns=(mtime_ns, mtime_ns))
+
+    def test_list_dates(self) -> None:
+        dates = Manifest(self.manifest_path).list_dates(
+            self.log_dir, log_format_regexp,
+        )
+        self.assertDictEqual(
+            dates, {'nginx-access-ui.log-20170630.gz': '20170630'},
+        )
+
+        # Unchanged directory is not listed again, even by another run
+        with mock.patch('os.scandir') as scandir:
+            self.assertDictEqual(
+                Manifest(self.manifest_path).list_dates(
+                    self.log_dir, log_format_regexp,
+                ),
+                dates,
+            )
+            scandir.assert_not_called()
+
+        self._touch(self.log_dir, 'nginx-access-ui.log-20170701')
+        self.assertIn(
+            'nginx-access-ui.log-20170701',
+            Manifest(self.manifest_path).list_dates(
+                self.log_dir, log_format_regexp,
+            ),
+        )
+
+    def test_next_log_file(self) -> None:
+        log_file = get_next_log_file(self.config)
+        assert log_file is not None
+        self.assertEqual(log_file.name, 'nginx-access-ui.log-20170630.gz')
+        self.assertEqual(log_file.date, datetime(2017, 6, 30))
+
+        self._touch(self.config.REPORT_DIR, 'report-20170630.html')
+        self.assertIsNone(get_next_log_file(self.config))
+
+
+if __name__ == '__main__':
+    unittest.main()
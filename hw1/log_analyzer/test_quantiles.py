@@ -0,0 +1,89 @@
+import random
+import unittest
+from statistics import median
+
+from quantiles import QuantileSketch
+
+
+class TestQuantileSketch(unittest.TestCase):
+    @staticmethod
+    def _sketch(
+            values: list[float],
+            relative_error: float = .01,
+            exact_limit: int = 1000,
+    ) -> QuantileSketch:
+        sketch = QuantileSketch(relative_error, exact_limit)
+        for value in values:
+            sketch.add(value)
+
+        return sketch
+
+    def test_exact_median(self) -> None:
+        for values in ([1.], [2., 3.], [3., 1., 2.], [.5, 0., 4., 1.]):
+            sketch = self._sketch(values)
+            self.assertTrue(sketch.is_exact)
+            self.assertAlmostEqual(sketch.quantile(.5), median(values))
+
+    def test_relative_error(self) -> None:
+        rnd = random.Random(42)
+        values = [rnd.lognormvariate(-2, 1.5) for _ in range(20000)]
+        sketch = self._sketch(values, relative_error=.01, exact_limit=100)
+        self.assertFalse(sketch.is_exact)
+
+        values.sort()
+        for q in (.5, .9, .95, .99):
+            expected = values[int(q * (len(values) - 1))]
+            self.assertLessEqual(
+                abs(sketch.quantile(q) - expected),
+                expected * .0101,
+            )
+
+    def test_zero_values(self) -> None:
+        sketch = self._sketch([0.] * 10 + [1.] * 5, exact_limit=1)
+        self.assertEqual(sketch.quantile(.5), 0.)
+        self.assertAlmostEqual(sketch.quantile(.99), 1., delta=.01)
+
+    def test_merge(self) -> None:
+        rnd = random.Random(7)
+        values = [rnd.uniform(.001, 10.) for _ in range(3000)]
+        whole = self._sketch(values, exact_limit=1000)
+
+        for split in (10, 1500, 2995):
+            merged = self._sketch(values[:split], exact_limit=1000)
+            merged.merge(self._sketch(values[split:], exact_limit=1000))
+            self.assertEqual(merged.count, whole.count)
+            for q in (.5, .9, .99):
+                self.assertAlmostEqual(merged.quantile(q), whole.quantile(q))
+
+    def test_merge_different_errors(self) -> None:
+        with self.assertRaises(ValueError):
+            QuantileSketch(relative_error=.01).merge(
+                QuantileSketch(relative_error=.02),
+            )
+
+    def test_squares_sum(self) -> None:
+        rnd = random.Random(4)
+        values = [rnd.expovariate(1) for _ in range(5000)]
+        expected = sum(value * value for value in values)
+
+        self.assertAlmostEqual(
+            self._sketch(values, exact_limit=len(values)).squares_sum(),
+            expected,
+        )
+        self.assertAlmostEqual(
+            self._sketch(values).squares_sum() / expected, 1, delta=.02,
+        )
+
+    def test_serialization(self) -> None:
+        values = [i / 100 for i in range(200)]
+        for exact_limit in (1000, 10):
+            sketch = self._sketch(values, exact_limit=exact_limit)
+            restored = QuantileSketch.from_bytes(sketch.to_bytes())
+            self.assertEqual(restored.is_exact, sketch.is_exact)
+            self.assertEqual(restored.count, sketch.count)
+            for q in (.1, .5, .99):
+                self.assertEqual(restored.quantile(q), sketch.quantile(q))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import os
+import unittest
+from datetime import datetime
+
+from log_parser import Request, RequestLog
+from parallel import aggregate_request_logs
+from stats import LogAggregate
+from store import get_missing_days, load_range, save_day
+from testing import TmpDirTestCase
+
+
+class TestStore(TmpDirTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.store_path = os.path.join(self.tmp_dir, 'aggregates.sqlite3')
+
+    @staticmethod
+    def _aggregate(logs: list[tuple[str, float, bool]]) -> LogAggregate:
+        return aggregate_request_logs(
+            RequestLog(
+                request=Request(name=name),
+                duration=duration,
+                success=success,
+            )
+            for name, duration, success in logs
+        )
+
+    def test_load_range(self) -> None:
+        day1 = [('/a', 1., True), ('/a', 2., True), ('/b', .5, False)]
+        day2 = [('/a', 3., True), ('/b', .5, True), ('/c', .1, True)]
+        day3 = [('/c', 10., True)]
+        save_day(self.store_path, datetime(2017, 6, 1), self._aggregate(day1))
+        save_day(self.store_path, datetime(2017, 6, 2), self._aggregate(day3))
+        # Day is replaced when it is saved again
+        save_day(self.store_path, datetime(2017, 6, 2), self._aggregate(day2))
+        save_day(self.store_path, datetime(2017, 6, 4), self._aggregate(day3))
+
+        aggregate = load_range(
+            self.store_path, datetime(2017, 6, 1), datetime(2017, 6, 3),
+        )
+        expected = self._aggregate(day1 + day2)
+        self.assertEqual(aggregate.total_lines, expected.total_lines)
+        self.assertAlmostEqual(aggregate.fault_rate, expected.fault_rate)
+
+        stats = {s.url: s for s in aggregate.calculate_stats()}
+        for expected_stat in expected.calculate_stats():
+            stat = stats.pop(expected_stat.url)
+            self.assertEqual(stat.count, expected_stat.count)
+            self.assertAlmostEqual(stat.time_sum, expected_stat.time_sum)
+            self.assertAlmostEqual(stat.time_max, expected_stat.time_max)
+            self.assertAlmostEqual(stat.time_med, expected_stat.time_med)
+        self.assertDictEqual(stats, {})
+
+        self.assertListEqual(
+            get_missing_days(
+                self.store_path, datetime(2017, 6, 1), datetime(2017, 6, 5),
+            ),
+            [datetime(2017, 6, 3), datetime(2017, 6, 5)],
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import unittest
+
+from log_parser import Request, RequestLog
+from parallel import aggregate_request_logs
+from stats import LogAggregate
+from urls import DistinctCounter, UrlNormalizer
+
+
+class TestUrls(unittest.TestCase):
+    def test_normalizer(self) -> None:
+        normalizer = UrlNormalizer()
+        for url, template in (
+                ('/api/v2/banner/25019354', '/api/v2/banner/{id}'),
+                ('/api/v2/banner/25019354/', '/api/v2/banner/{id}/'),
+                ('/api/1/campaigns/?id=7789711',
+                 '/api/{id}/campaigns/?id={id}'),
+                ('/slot/4705/groups?uid=0a1b2c3d-4e5f-6a7b-8c9d-0e1f2a3b4c5d',
+                 '/slot/{id}/groups?uid={uuid}'),
+                ('/api/v2/group/7786679/statistic/sites/?date_type=day',
+                 '/api/v2/group/{id}/statistic/sites/?date_type=day'),
+                ('/export/appinstall_raw/2017-06-29/',
+                 '/export/appinstall_raw/2017-06-29/'),
+        ):
+            self.assertEqual(normalizer(url), template)
+
+        self.assertEqual(
+            UrlNormalizer(strip_query=True)('/api/1/campaigns/?id=7789711'),
+            '/api/{id}/campaigns/',
+        )
+
+    def test_distinct_counter(self) -> None:
+        counter = DistinctCounter(size=64)
+        for i in range(50):
+            counter.add(f'/api/{i}')
+            counter.add(f'/api/{i}')
+        self.assertEqual(counter.estimate(), 50)
+
+        other = DistinctCounter(size=64)
+        for i in range(20_000):
+            other.add(f'/other/{i}')
+        counter.merge(other)
+        self.assertAlmostEqual(counter.estimate(), 20_050, delta=20_050 * .3)
+
+        restored = DistinctCounter.from_bytes(counter.to_bytes(), size=64)
+        self.assertEqual(restored.estimate(), counter.estimate())
+
+    def test_aggregate_templates(self) -> None:
+        aggregate = aggregate_request_logs(
+            (
+                RequestLog(
+                    request=Request(name=f'/api/v2/banner/{i % 30}'),
+                    duration=.1,
+                )
+                for i in range(100)
+            ),
+            lambda: LogAggregate(normalizer=UrlNormalizer()),
+        )
+        stats = aggregate.calculate_stats()
+        self.assertEqual(len(stats), 1)
+        self.assertEqual(stats[0].url, '/api/v2/banner/{id}')
+        self.assertEqual(stats[0].count, 100)
+        self.assertEqual(stats[0].to_dict()['raw_url_count'], 30)
+
+        raw_aggregate = aggregate_request_logs([
+            RequestLog(request=Request(name='/api/v2/banner/1'), duration=.1),
+        ])
+        raw_stats = raw_aggregate.calculate_stats()
+        self.assertEqual(raw_stats[0].url, '/api/v2/banner/1')
+        self.assertNotIn('raw_url_count', raw_stats[0].to_dict())
+
+
+if __name__ == '__main__':
+    unittest.main()
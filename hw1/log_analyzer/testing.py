@@ -0,0 +1,16 @@
+import tempfile
+import unittest
+
+LOG_LINE = (
+    '1.200.76.128 f032b48fb33e1e692  - [29/Jun/2017:03:50:24 +0300] '
+    '"GET {url} HTTP/1.1" 200 608 "-" "-" "-" '
+    '"1498697424-4102637017-4708-9752795" "-" {duration}\n'
+)
+
+
+class TmpDirTestCase(unittest.TestCase):
+    # Every test gets its own temporary directory, removed after the test
+    def setUp(self) -> None:
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.tmp_dir = tmp_dir.name
@@ -0,0 +1,94 @@
+from __future__ import annotations
+
+import heapq
+import re
+import sys
+from array import array
+from hashlib import blake2b
+
+uuid_regexp = re.compile(
+    r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$',
+    re.IGNORECASE,
+)
+
+
+def _template_value(value: str) -> str:
+    if value.isdigit():
+        return '{id}'
+    if len(value) == 36 and re.match(uuid_regexp, value):
+        return '{uuid}'
+
+    return value
+
+
+class UrlNormalizer:
+    # Collapses numeric and UUID path segments (and query values)
+    # into placeholders: /api/v2/banner/25019354 -> /api/v2/banner/{id}
+    def __init__(self, strip_query: bool = False) -> None:
+        self.strip_query = strip_query
+
+    def __call__(self, url: str) -> str:
+        path, separator, query = url.partition('?')
+        template = '/'.join(map(_template_value, path.split('/')))
+
+        if separator and not self.strip_query:
+            params = []
+            for param in query.split('&'):
+                name, equals, value = param.partition('=')
+                params.append(name + equals + _template_value(value))
+            template += separator + '&'.join(params)
+
+        return sys.intern(template)
+
+
+def _url_hash(url: str) -> int:
+    # Builtin hash() of str differs between processes, so it can't be used
+    # for counters merged from workers or saved to disk
+    return int.from_bytes(
+        blake2b(url.encode('utf-8'), digest_size=8).digest(),
+        'little',
+    )
+
+
+class DistinctCounter:
+    # K minimum values estimator of the number of distinct URLs: exact up to
+    # size distinct values, then the error is about 1 / sqrt(size)
+    def __init__(self, size: int = 256) -> None:
+        self.size = size
+        self._hashes: set[int] = set()
+        self._heap: list[int] = []  # negated hashes, max hash on top
+
+    def add(self, url: str) -> None:
+        self._add_hash(_url_hash(url))
+
+    def merge(self, other: DistinctCounter) -> None:
+        for url_hash in other._hashes:
+            self._add_hash(url_hash)
+
+    def estimate(self) -> int:
+        if len(self._hashes) < self.size:
+            return len(self._hashes)
+
+        return round((self.size - 1) * 2 ** 64 / -self._heap[0])
+
+    def to_bytes(self) -> bytes:
+        return array('Q', self._hashes).tobytes()
+
+    @classmethod
+    def from_bytes(cls, data: bytes, size: int = 256) -> DistinctCounter:
+        counter = cls(size)
+        for url_hash in array('Q', data):
+            counter._add_hash(url_hash)
+
+        return counter
+
+    def _add_hash(self, url_hash: int) -> None:
+        if url_hash in self._hashes:
+            return
+
+        if len(self._hashes) < self.size:
+            self._hashes.add(url_hash)
+            heapq.heappush(self._heap, -url_hash)
+        elif url_hash < -self._heap[0]:
+            self._hashes.discard(-heapq.heapreplace(self._heap, -url_hash))
+            self._hashes.add(url_hash)
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -----------------
+# Оценка сразу многих "рук" из 7ми карт массивами numpy.
+# Карты закодированы как в evaluator: (ранг - 2) * 4 + масть, 0..51.
+# Для каждой "руки" возвращается категория (первый элемент значения
+# hand_rank лучшей "руки" из 5ти карт) и ключ: категория и до 5ти рангов
+# (0..12) для сравнения внутри категории, упакованные в одно число.
+# Ключи сравниваются так же, как значения hand_rank лучших "рук".
+# -----------------
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from evaluator import HAND_RANKS, best_five, encode_card
+
+CATEGORY_SHIFT = 20
+RANK_BITS = 4
+
+
+def _build_tables():
+    masks = np.arange(1 << 13)
+    members = (masks[:, None] >> np.arange(13)) & 1 == 1
+    # Ранги каждой маски от старшего к младшему, -1 после последнего
+    top_ranks = -np.sort(-np.where(members, np.arange(13), -1), axis=1)
+    straight_tops = np.full(len(masks), -1)
+    for top in range(4, 13):
+        window = 0b11111 << (top - 4)
+        straight_tops[(masks & window) == window] = top
+    return top_ranks[:, :5], straight_tops
+
+
+if np is not None:
+    _TOP_RANKS, _STRAIGHT_TOPS = _build_tables()
+
+
+def _mask(members):
+    """Битовые маски рангов для массива (N, 13)"""
+    return members @ (1 << np.arange(13))
+
+
+def _without(masks, *ranks):
+    """Маски без рангов ranks (-1 - нет ранга)"""
+    for rank in ranks:
+        masks = masks & ~np.where(rank >= 0, 1 << np.maximum(rank, 0), 0)
+    return masks
+
+
+def _pack(*columns):
+    """Упаковывает до 5ти рангов (N,) или (N, k) в ключи, -1 как 0"""
+    keys = 0
+    position = 0
+    for column in columns:
+        column = column.reshape(len(column), -1)
+        for index in range(column.shape[1]):
+            shift = RANK_BITS * (4 - position)
+            keys = keys | np.maximum(column[:, index], 0) << shift
+            position += 1
+    return keys
+
+
+def rank_batch(cards):
+    """Возвращает категории и ключи лучших "рук" из 5ти карт для массива
+    "рук" из 7ми карт формы (N, 7)"""
+    if np is None:
+        raise RuntimeError('numpy is required for rank_batch')
+
+    cards = np.asarray(cards, dtype=np.int64)
+    hands = len(cards)
+    ranks = cards >> 2
+    suits = cards & 3
+    rows = np.arange(hands)[:, None]
+    rank_counts = np.bincount(
+        (rows * 13 + ranks).ravel(), minlength=hands * 13,
+    ).reshape(hands, 13)
+    suit_counts = np.bincount(
+        (rows * 4 + suits).ravel(), minlength=hands * 4,
+    ).reshape(hands, 4)
+
+    present = _mask(rank_counts > 0)
+    has_flush = suit_counts.max(axis=1) >= 5
+    flush_suits = suit_counts.argmax(axis=1)
+    in_flush = has_flush[:, None] & (suits == flush_suits[:, None])
+    flush_masks = np.where(in_flush, 1 << ranks, 0).sum(axis=1)
+    straight_tops = _STRAIGHT_TOPS[present]
+    straight_flush_tops = _STRAIGHT_TOPS[flush_masks]
+
+    quads = _TOP_RANKS[_mask(rank_counts == 4), 0]
+    trips = _TOP_RANKS[_mask(rank_counts == 3), :2]
+    pairs = _TOP_RANKS[_mask(rank_counts == 2), :3]
+    full_house_pairs = _TOP_RANKS[
+        _without(_mask(rank_counts >= 2), trips[:, 0]), 0
+    ]
+
+    conditions = [
+        straight_flush_tops >= 0,
+        quads >= 0,
+        (trips[:, 0] >= 0) & (full_house_pairs >= 0),
+        has_flush,
+        straight_tops >= 0,
+        trips[:, 0] >= 0,
+        pairs[:, 1] >= 0,
+        pairs[:, 0] >= 0,
+    ]
+    categories = np.select(conditions, [8, 7, 6, 5, 4, 3, 2, 1], 0)
+    tiebreaks = np.select(conditions, [
+        _pack(straight_flush_tops),
+        _pack(quads, _TOP_RANKS[_without(present, quads), 0]),
+        _pack(trips[:, 0], full_house_pairs),
+        _pack(_TOP_RANKS[flush_masks]),
+        _pack(straight_tops),
+        _pack(trips[:, 0], _TOP_RANKS[_without(present, trips[:, 0]), :2]),
+        _pack(pairs[:, :2], _TOP_RANKS[
+            _without(present, pairs[:, 0], pairs[:, 1]), 0
+        ]),
+        _pack(pairs[:, 0], _TOP_RANKS[_without(present, pairs[:, 0]), :3]),
+    ], _pack(_TOP_RANKS[present]))
+    return categories, categories << CATEGORY_SHIFT | tiebreaks
+
+
+def test_rank_batch():
+    print("test_rank_batch...")
+    if np is None:
+        print('skipped, numpy is not installed')
+        return
+
+    rng = np.random.default_rng(0)
+    cards = np.argsort(rng.random((20000, 52)), axis=1)[:, :7]
+    # Флеши, стриты, каре и фулл-хаусы для выборки редких категорий
+    special = [
+        "6C 7C 8C 9C TC 5C JS",
+        "AS KS QS JS 9S TD 6H",
+        "TD TC TH 7C 7D 8C 8S",
+        "9D 9C 9H 2C 2D 2S KS",
+        "JD TC TH 7C 7D 7S 7H",
+        "AS 2C 3D 4H 5S 6D 9H",
+    ]
+    cards = np.vstack([
+        [[encode_card(card) for card in hand.split()] for hand in special],
+        cards,
+    ])
+    categories, keys = rank_batch(cards)
+
+    values = [best_five(hand.tolist())[0] for hand in cards]
+    for category, value in zip(categories, values):
+        assert category == HAND_RANKS[value][0]
+    order = np.argsort(values, kind='stable')
+    sorted_values = np.asarray(values)[order]
+    sorted_keys = keys[order]
+    assert (np.diff(sorted_keys) >= 0).all()
+    assert ((np.diff(sorted_keys) == 0)
+            == (np.diff(sorted_values) == 0)).all()
+    print('OK')
+
+
+if __name__ == '__main__':
+    test_rank_batch()
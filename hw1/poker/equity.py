@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -----------------
+# Оценка шансов (equity) "руки" методом Монте-Карло.
+# Недостающие карты стола и карты соперников раздаются случайно
+# пачками по batch_size раздач. Пачки считаются в пуле процессов, у
+# каждой пачки свое зерно генератора, полученное из seed, поэтому
+# результат с одним seed не зависит от числа процессов. Раздачи
+# прекращаются, когда стандартная ошибка процента побед и процента
+# ничьих становится не больше precision.
+# -----------------
+import math
+import os
+import random
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from batch import rank_batch
+from evaluator import best_five, encode_hand
+
+BATCH_SIZE = 10000
+MAX_TRIALS = 1000000
+
+Equity = namedtuple('Equity', 'win tie win_error tie_error trials')
+
+
+def _simulate_numpy(hole, board, opponents, trials, seed):
+    rng = np.random.default_rng(seed)
+    used = set(hole) | set(board)
+    deck = np.array([card for card in range(52) if card not in used])
+    missing = 5 - len(board)
+    order = np.argsort(rng.random((trials, len(deck))), axis=1)
+    dealt = deck[order[:, :missing + 2 * opponents]]
+
+    board_cards = np.hstack([
+        np.tile(np.array(board, dtype=np.int64), (trials, 1)),
+        dealt[:, :missing],
+    ])
+    hands = [np.hstack([np.tile(hole, (trials, 1)), board_cards])]
+    for opponent in range(opponents):
+        start = missing + 2 * opponent
+        hands.append(np.hstack([dealt[:, start:start + 2], board_cards]))
+    _, keys = rank_batch(np.vstack(hands))
+    keys = keys.reshape(opponents + 1, trials)
+
+    best_other = keys[1:].max(axis=0)
+    wins = int((keys[0] > best_other).sum())
+    ties = int((keys[0] == best_other).sum())
+    return wins, ties
+
+
+def _simulate_python(hole, board, opponents, trials, seed):
+    rng = random.Random(seed)
+    used = set(hole) | set(board)
+    deck = [card for card in range(52) if card not in used]
+    missing = 5 - len(board)
+
+    wins = ties = 0
+    for _ in range(trials):
+        dealt = rng.sample(deck, missing + 2 * opponents)
+        board_cards = board + dealt[:missing]
+        value, _ = best_five(hole + board_cards)
+        best_other = max(
+            best_five(dealt[start:start + 2] + board_cards)[0]
+            for start in range(missing, missing + 2 * opponents, 2)
+        )
+        if value > best_other:
+            wins += 1
+        elif value == best_other:
+            ties += 1
+    return wins, ties
+
+
+def simulate(hole, board, opponents, trials, seed):
+    """Возвращает число побед и ничьих в trials случайных раздачах.
+    Карты в числовой кодировке evaluator"""
+    if np is not None:
+        return _simulate_numpy(hole, board, opponents, trials, seed)
+
+    return _simulate_python(hole, board, opponents, trials, seed)
+
+
+def _equity(wins, ties, trials):
+    win = wins / trials
+    tie = ties / trials
+    return Equity(
+        win=100 * win,
+        tie=100 * tie,
+        win_error=100 * math.sqrt(win * (1 - win) / trials),
+        tie_error=100 * math.sqrt(tie * (1 - tie) / trials),
+        trials=trials,
+    )
+
+
+def equity(
+        hole,
+        board=(),
+        opponents=1,
+        precision=.1,
+        workers=None,
+        seed=None,
+        batch_size=BATCH_SIZE,
+        max_trials=MAX_TRIALS,
+):
+    """Возвращает проценты побед и ничьих "руки" hole (2 карты) при
+    открытых картах стола board (0..5 карт) против opponents соперников
+    и их стандартные ошибки в процентах"""
+    hole = encode_hand(hole)
+    board = encode_hand(board)
+    cards = hole + board
+    if len(hole) != 2 or len(board) > 5:
+        raise ValueError('2 hole cards and up to 5 board cards expected')
+    if len(set(cards)) < len(cards):
+        raise ValueError('cards are repeated')
+    if opponents < 1 or len(cards) + 5 - len(board) + 2 * opponents > 52:
+        raise ValueError(f'wrong number of opponents: {opponents}')
+    if max_trials < 1 or batch_size < 1:
+        raise ValueError('max_trials and batch_size must be positive')
+
+    workers = workers or os.cpu_count() or 1
+    seeds = random.Random(seed)
+    batches = (
+        (hole, board, opponents, min(batch_size, max_trials - start),
+         seeds.getrandbits(64))
+        for start in range(0, max_trials, batch_size)
+    )
+
+    wins = ties = trials = 0
+    for batch_trials, (batch_wins, batch_ties) in _batch_results(
+            batches, workers):
+        wins += batch_wins
+        ties += batch_ties
+        trials += batch_trials
+        result = _equity(wins, ties, trials)
+        if max(result.win_error, result.tie_error) <= precision:
+            break
+
+    return result
+
+
+def _batch_results(batches, workers):
+    """Возвращает (число раздач, результат simulate) для пачек по порядку,
+    чтобы остановка не зависела от того, какой процесс закончил раньше.
+    В пул отправляется не больше workers * 2 пачек вперед"""
+    if workers <= 1:
+        for batch in batches:
+            yield batch[3], simulate(*batch)
+        return
+
+    executor = ProcessPoolExecutor(max_workers=workers)
+    pending = deque()
+    try:
+        for batch in batches:
+            pending.append((batch[3], executor.submit(simulate, *batch)))
+            if len(pending) >= workers * 2:
+                batch_trials, future = pending.popleft()
+                yield batch_trials, future.result()
+        while pending:
+            batch_trials, future = pending.popleft()
+            yield batch_trials, future.result()
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+def test_equity():
+    print("test_equity...")
+    # Роял-флеш на столе: у всех ничья
+    result = equity("2C 3D".split(), "AS KS QS JS TS".split(), opponents=3)
+    assert result.tie == 100 and result.tie_error == 0
+    assert result.trials == BATCH_SIZE
+    # Старший стрит-флеш у нас
+    result = equity("AS KS".split(), "QS JS TS".split(), opponents=2)
+    assert result.win == 100
+
+    # Пара тузов против случайной руки выигрывает около 85% раздач
+    result = equity("AS AD".split(), precision=.3, seed=1, workers=1)
+    assert result.win_error <= .3
+    assert abs(result.win + result.tie / 2 - 85.2) < 4 * result.win_error
+    assert result.trials < MAX_TRIALS
+    assert equity("AS AD".split(), precision=.3, seed=1, workers=2) == result
+
+    result = equity("AS AD".split(), max_trials=500, batch_size=200,
+                    seed=1, workers=1)
+    assert result.trials == 500
+
+    for hole, board, opponents in [
+            ("AS AS", "", 1), ("AS", "", 1), ("AS KD", "", 30),
+    ]:
+        try:
+            equity(hole.split(), board.split(), opponents)
+        except ValueError:
+            pass
+        else:
+            assert False, hole
+    for max_trials, batch_size in [(0, BATCH_SIZE), (-5, 10), (100, 0)]:
+        try:
+            equity("AS AD".split(), max_trials=max_trials,
+                   batch_size=batch_size)
+        except ValueError:
+            pass
+        else:
+            assert False, (max_trials, batch_size)
+    print('OK')
+
+
+def test_simulate():
+    print("test_simulate...")
+    # Без numpy раздачи считаются по одной, результат близок
+    hole = encode_hand("7C 2D".split())
+    board = encode_hand("7S 8H".split())
+    trials = 20000
+    wins, ties = _simulate_python(hole, board, 2, trials, seed=0)
+    if np is not None:
+        numpy_wins, numpy_ties = _simulate_numpy(hole, board, 2, trials, 0)
+        error = 4 * math.sqrt(trials * .25)
+        assert abs(wins - numpy_wins) < error
+        assert abs(ties - numpy_ties) < error
+    print('OK')
+
+
+if __name__ == '__main__':
+    test_simulate()
+    test_equity()
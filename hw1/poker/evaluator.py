@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -----------------
+# Быстрая оценка покерных "рук" по таблицам.
+# Карта кодируется числом (ранг - 2) * 4 + масть, 0..51, масти по
+# порядку SUITS. Ранг "руки" из 5ти карт - индекс в списке HAND_RANKS
+# всех различных значений hand_rank, отсортированном по возрастанию,
+# поэтому числа сравниваются так же, как значения hand_rank.
+# Флеши ищутся в таблице по битовой маске рангов, остальные "руки" -
+# по произведению простых чисел, соответствующих рангам.
+# -----------------
+import itertools
+import random
+from collections import Counter
+
+RANKS = '23456789TJQKA'
+SUITS = 'CDHS'
+PRIMES = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41)
+
+_CARD_PRIMES = [PRIMES[card >> 2] for card in range(52)]
+_CARD_BITS = [1 << (card >> 2) for card in range(52)]
+
+
+def encode_card(card):
+    """Возвращает число, соответствующее карте, например 'AS' -> 51"""
+    return RANKS.index(card[0]) * 4 + SUITS.index(card[1])
+
+
+def decode_card(code):
+    """Возвращает карту, соответствующую числу, например 51 -> 'AS'"""
+    return RANKS[code >> 2] + SUITS[code & 3]
+
+
+def encode_hand(hand):
+    return [encode_card(card) for card in hand]
+
+
+def rank_key(ranks, suited):
+    """Возвращает значение hand_rank для рангов 5ти карт (числа 2..14,
+    отсортированные от большего к меньшему), списки заменены кортежами"""
+    counts = Counter(ranks)
+    groups = sorted(counts, key=lambda rank: (counts[rank], rank),
+                    reverse=True)
+    pattern = sorted(counts.values(), reverse=True)
+    straight = len(counts) == 5 and ranks[0] - ranks[4] == 4
+    if straight and suited:
+        return (8, ranks[0])
+    elif pattern[0] == 4:
+        return (7, groups[0], groups[1])
+    elif pattern == [3, 2]:
+        return (6, groups[0], groups[1])
+    elif suited:
+        return (5, ranks)
+    elif straight:
+        return (4, ranks[0])
+    elif pattern[0] == 3:
+        return (3, groups[0], ranks)
+    elif pattern[:2] == [2, 2]:
+        return (2, (groups[0], groups[1]), ranks)
+    elif pattern[0] == 2:
+        return (1, groups[0], ranks)
+    else:
+        return (0, ranks)
+
+
+def _build_tables():
+    flush_keys = {}
+    other_keys = {}
+    for ranks in itertools.combinations_with_replacement(range(14, 1, -1), 5):
+        if ranks[0] == ranks[4]:
+            continue
+
+        product = 1
+        for rank in ranks:
+            product *= PRIMES[rank - 2]
+        other_keys[product] = rank_key(ranks, suited=False)
+        if len(set(ranks)) == 5:
+            mask = sum(1 << (rank - 2) for rank in ranks)
+            flush_keys[mask] = rank_key(ranks, suited=True)
+
+    hand_ranks = sorted(set(flush_keys.values()) | set(other_keys.values()))
+    values = {key: value for value, key in enumerate(hand_ranks)}
+    flushes = [-1] * (1 << len(RANKS))
+    for mask, key in flush_keys.items():
+        flushes[mask] = values[key]
+    others = {product: values[key] for product, key in other_keys.items()}
+    return hand_ranks, flushes, others
+
+
+HAND_RANKS, _FLUSHES, _OTHERS = _build_tables()
+# Ранг младшего стрит-флеша, старше него только стрит-флеши
+_STRAIGHT_FLUSHES = HAND_RANKS.index((8, 6))
+
+
+def evaluate5(cards):
+    """Возвращает ранг 5ти карт в числовой кодировке: индекс значения
+    hand_rank в HAND_RANKS"""
+    a, b, c, d, e = cards
+    if (a & 3) == (b & 3) == (c & 3) == (d & 3) == (e & 3):
+        bits = _CARD_BITS
+        return _FLUSHES[bits[a] | bits[b] | bits[c] | bits[d] | bits[e]]
+
+    primes = _CARD_PRIMES
+    return _OTHERS[primes[a] * primes[b] * primes[c] * primes[d] * primes[e]]
+
+
+def hand_value(hand):
+    """evaluate5 для "руки" из 5ти карт в строковом виде"""
+    return evaluate5(encode_hand(hand))
+
+
+def _top_straight(mask):
+    """Возвращает старший ранг (0..12) старшего стрита в битовой маске
+    рангов или None. Стрит от туза до пятерки hand_rank не считает"""
+    for top in range(len(RANKS) - 1, 3, -1):
+        straight = 0b11111 << (top - 4)
+        if mask & straight == straight:
+            return top
+
+    return None
+
+
+_STRAIGHT_TOPS = [_top_straight(mask) for mask in range(1 << len(RANKS))]
+_BIT_COUNTS = [bin(mask).count('1') for mask in range(1 << len(RANKS))]
+
+
+def best_five(cards):
+    """Возвращает (ранг, 5 карт) лучшей "руки" из 5ти карт среди 5..9
+    различных карт за один проход по количествам рангов и битовым маскам
+    мастей, без перебора сочетаний"""
+    by_rank = {}
+    suit_masks = [0, 0, 0, 0]
+    for card in cards:
+        rank = card >> 2
+        if rank in by_rank:
+            by_rank[rank].append(card)
+        else:
+            by_rank[rank] = [card]
+        suit_masks[card & 3] |= 1 << rank
+
+    flush = None
+    for suit, mask in enumerate(suit_masks):
+        if _BIT_COUNTS[mask] < 5:
+            continue
+
+        top = _STRAIGHT_TOPS[mask]
+        if top is not None:
+            five = [rank * 4 + suit for rank in range(top, top - 5, -1)]
+        else:
+            ranks = [rank for rank in range(len(RANKS) - 1, -1, -1)
+                     if mask >> rank & 1]
+            five = [rank * 4 + suit for rank in ranks[:5]]
+        candidate = (evaluate5(five), five)
+        if flush is None or candidate[0] > flush[0]:
+            flush = candidate
+
+    if flush is not None and flush[0] >= _STRAIGHT_FLUSHES:
+        return flush
+
+    # Ранги от старшего к младшему, сгруппированные по количеству карт
+    present = sorted(by_rank, reverse=True)
+    groups = [[], [], [], [], []]
+    rank_mask = 0
+    for rank in present:
+        groups[len(by_rank[rank])].append(rank)
+        rank_mask |= 1 << rank
+    _, _, pairs, trips, quads = groups
+    straight = _STRAIGHT_TOPS[rank_mask]
+
+    if quads:
+        quad = quads[0]
+        kicker = next(rank for rank in present if rank != quad)
+        five = by_rank[quad] + by_rank[kicker][:1]
+    elif trips and len(trips) + len(pairs) > 1:
+        trip = trips[0]
+        pair = next(rank for rank in present
+                    if rank != trip and len(by_rank[rank]) >= 2)
+        five = by_rank[trip] + by_rank[pair][:2]
+    elif flush is not None:
+        return flush
+    elif straight is not None:
+        five = [by_rank[rank][0] for rank in range(straight, straight - 5, -1)]
+    else:
+        # Тройка, пары или старшая карта: группы, затем старшие кикеры
+        made = trips[:1] or pairs[:2]
+        five = [card for rank in made for card in by_rank[rank]]
+        kickers = [rank for rank in present if rank not in made]
+        five.extend(by_rank[rank][0] for rank in kickers[:5 - len(five)])
+
+    return evaluate5(five), five
+
+
+def best_five_batch(hands):
+    """best_five для каждой "руки" из hands"""
+    return [best_five(cards) for cards in hands]
+
+
+def _frozen_rank(rank):
+    return tuple(tuple(item) if isinstance(item, list) else item
+                 for item in rank)
+
+
+def test_encode_card():
+    print("test_encode_card...")
+    assert encode_card('2C') == 0
+    assert encode_card('AS') == 51
+    assert [decode_card(code) for code in range(52)] == [
+        rank + suit for rank in RANKS for suit in SUITS
+    ]
+    print('OK')
+
+
+def test_evaluate5():
+    print("test_evaluate5...")
+    from poker import hand_rank
+
+    deck = [decode_card(code) for code in range(52)]
+    hands = [
+        "6C 7C 8C 9C TC".split(),
+        "AS 2C 3D 4H 5S".split(),
+        "AS 2S 3S 4S 5S".split(),
+        "TD TC TH 7C 7D".split(),
+        "7C 7D 7S 7H JD".split(),
+    ]
+    rng = random.Random(0)
+    hands.extend(rng.sample(deck, 5) for _ in range(20000))
+    for hand in hands:
+        value = hand_value(hand)
+        assert HAND_RANKS[value] == _frozen_rank(hand_rank(hand)), hand
+    for hand1, hand2 in zip(hands, hands[1:]):
+        assert ((hand_value(hand1) < hand_value(hand2))
+                == (hand_rank(hand1) < hand_rank(hand2)))
+    print('OK')
+
+
+def test_best_five():
+    print("test_best_five...")
+    deck = list(range(52))
+    hands = [
+        encode_hand("6C 7C 8C 9C TC 5C JS".split()),
+        encode_hand("TD TC TH 7C 7D 8C 8S".split()),
+        encode_hand("JD TC TH 7C 7D 7S 7H".split()),
+        encode_hand("AS 2S 3S 4S 5S 6D 6H".split()),
+        encode_hand("AS KS QS JS 9S TD 6H".split()),
+    ]
+    rng = random.Random(0)
+    hands.extend(rng.sample(deck, rng.choice((5, 6, 7)))
+                 for _ in range(5000))
+    for hand, (value, five) in zip(hands, best_five_batch(hands)):
+        assert len(set(five)) == 5 and set(five) <= set(hand), hand
+        assert value == evaluate5(five)
+        assert value == max(map(evaluate5, itertools.combinations(hand, 5)))
+    print('OK')
+
+
+if __name__ == '__main__':
+    test_encode_card()
+    test_evaluate5()
+    test_best_five()
@@ -28,7 +28,11 @@
 # Вам наверняка пригодится itertools.
 # Можно свободно определять свои функции и т.п.
 # -----------------
+import functools
 import itertools
+import random
+
+from evaluator import best_five, decode_card, encode_card
 
 
 def hand_rank(hand):
@@ -103,7 +107,14 @@ def two_pair(ranks):
 
 def best_hand(hand):
     """Из "руки" в 7 карт возвращает лучшую "руку" в 5 карт """
-    return max((hand_rank(h), h) for h in itertools.combinations(hand, 5))[1]
+    cards = {encode_card(card): card for card in hand}
+    _, five = best_five(cards)
+    return [cards[card] for card in five]
+
+
+def best_hands(hands):
+    """best_hand для каждой "руки" из hands"""
+    return [best_hand(hand) for hand in hands]
 
 
 def joker_variations(joker):
@@ -112,21 +123,128 @@ def joker_variations(joker):
     return [t[0] + t[1] for t in itertools.product(values, types)]
 
 
+def _mask_ranks(mask):
+    """Ранги (0..12) битовой маски от старшего к младшему"""
+    return [rank for rank in range(12, -1, -1) if mask >> rank & 1]
+
+
+def _straight_gaps(mask, wild):
+    """Ранги, которых не хватает маске рангов до стрита, если их не
+    больше wild"""
+    gaps = 0
+    for top in range(12, 3, -1):
+        missing = (0b11111 << (top - 4)) & ~mask
+        if bin(missing).count('1') <= wild:
+            gaps |= missing
+    return gaps
+
+
+@functools.lru_cache(maxsize=None)
+def _joker_codes(joker):
+    return [encode_card(card) for card in joker_variations(joker)]
+
+
+def _joker_suits(jokers):
+    """Сколько джокеров может стать картой каждой масти"""
+    return [sum(any(code & 3 == suit for code in _joker_codes(joker))
+                for joker in jokers) for suit in range(4)]
+
+
+def _flush_suits(cards, jokers):
+    """Для каждой масти - может ли она с джокерами собрать флеш"""
+    suit_counts = [0, 0, 0, 0]
+    for card in cards:
+        suit_counts[card & 3] += 1
+    return [count + wild >= 5
+            for count, wild in zip(suit_counts, _joker_suits(jokers))]
+
+
+def joker_substitutions(cards, jokers):
+    """Для каждого джокера возвращает карты (в числовой кодировке), на
+    которые его имеет смысл заменить при картах cards: старшие ранги карт
+    руки (пары, тройки, каре), недостающие до стрита ранги, старший
+    свободный ранг (кикер) и для возможных флешей - старшие свободные карты
+    масти и недостающие до стрит-флеша. Из карт одного ранга, которые не
+    могут собрать флеш, остается одна"""
+    rank_mask = 0
+    rank_counts = [0] * 13
+    suit_masks = [0, 0, 0, 0]
+    for card in cards:
+        rank_mask |= 1 << (card >> 2)
+        rank_counts[card >> 2] += 1
+        suit_masks[card & 3] |= 1 << (card >> 2)
+
+    variations = [_joker_codes(joker) for joker in jokers]
+    wild = _joker_suits(jokers)
+    flush_suits = _flush_suits(cards, jokers)
+    flush_masks = [0, 0, 0, 0]
+    for suit in range(4):
+        if flush_suits[suit]:
+            free = ~suit_masks[suit] & 0x1fff
+            top_free = _mask_ranks(free)[:wild[suit]]
+            flush_masks[suit] = (_straight_gaps(suit_masks[suit], wild[suit])
+                                 | sum(1 << rank for rank in top_free))
+
+    substitutions = []
+    straight_gaps = _straight_gaps(rank_mask, len(jokers))
+    for codes in variations:
+        free = [code for code in codes if code not in cards]
+        by_rank = {}
+        for code in free:
+            by_rank.setdefault(code >> 2, []).append(code)
+
+        # Из рангов руки с одинаковым числом карт старший дает не меньше,
+        # а двум джокерам могут понадобиться два ранга. Старший свободный
+        # ранг - кикер, например к каре или к двум парам из трех
+        useful = straight_gaps | 1 << max(by_rank)
+        groups = [0, 0, 0, 0, 0]
+        for rank in sorted(by_rank, reverse=True):
+            count = rank_counts[rank]
+            if count and groups[count] < len(jokers):
+                groups[count] += 1
+                useful |= 1 << rank
+
+        candidates = set()
+        for rank, rank_codes in by_rank.items():
+            flush_codes = [code for code in rank_codes
+                           if flush_masks[code & 3] >> rank & 1]
+            candidates.update(flush_codes)
+            if useful >> rank & 1:
+                plain = [code for code in rank_codes
+                         if not flush_suits[code & 3]]
+                candidates.update(plain[:1] or rank_codes)
+        substitutions.append(sorted(candidates))
+
+    return substitutions
+
+
 def best_wild_hand(hand):
     """best_hand но с джокерами"""
-    non_jokers = list(filter(lambda x: x[0] != '?', hand))
-    jokers = filter(lambda x: x[0] == '?', hand)
+    cards = {encode_card(card): card for card in hand if card[0] != '?'}
+    jokers = [card for card in hand if card[0] == '?']
 
-    jokers_variations = itertools.product(
-        *[joker_variations(joker) for joker in jokers]
-    )
+    # Замены, дающие те же ранги и те же карты мастей, в которых
+    # возможен флеш, равноценны
+    flush_suits = _flush_suits(cards, jokers)
 
-    best_hands = []
-    for variations in jokers_variations:
-        full_hand = itertools.chain(variations, non_jokers)
-        best_hands.append(best_hand(full_hand))
+    best = None
+    seen = set()
+    for variation in itertools.product(
+            *joker_substitutions(list(cards), jokers)):
+        if len(set(variation)) < len(variation):
+            continue
 
-    return max((hand_rank(h), h) for h in best_hands)[1]
+        key = tuple(sorted(code if flush_suits[code & 3] else -1 - (code >> 2)
+                           for code in variation))
+        if key in seen:
+            continue
+
+        seen.add(key)
+        candidate = best_five(list(cards) + list(variation))
+        if best is None or candidate[0] > best[0]:
+            best = candidate
+
+    return [cards.get(card) or decode_card(card) for card in best[1]]
 
 
 def test_best_hand():
@@ -151,6 +269,28 @@ def test_best_wild_hand():
     print('OK')
 
 
+def test_joker_substitutions():
+    print("test_joker_substitutions...")
+    deck = [decode_card(code) for code in range(52)]
+    rng = random.Random(0)
+    for _ in range(300):
+        jokers = rng.choice([['?B'], ['?R'], ['?B', '?R']])
+        hand = rng.sample(deck, 7 - len(jokers)) + jokers
+        cards = [encode_card(card) for card in hand[:7 - len(jokers)]]
+        # Перебор всех замен, кроме карт, которые уже есть в руке
+        expected = max(
+            best_five(cards + [encode_card(card) for card in variation])[0]
+            for variation in itertools.product(
+                *[joker_variations(joker) for joker in jokers])
+            if not set(variation) & set(hand)
+            and len(set(variation)) == len(variation)
+        )
+        best = best_wild_hand(hand)
+        assert best_five([encode_card(card) for card in best])[0] == expected
+    print('OK')
+
+
 if __name__ == '__main__':
     test_best_hand()
     test_best_wild_hand()
+    test_joker_substitutions()